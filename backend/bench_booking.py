@@ -0,0 +1,157 @@
+"""Contention benchmark for the seat booking engine.
+
+Fires many concurrent holds at a single popular ride and checks that no
+seat is oversold or lost:
+
+    MONGO_URL=mongodb://localhost:27017 python bench_booking.py --riders 500 --seats 4
+
+MONGO_URL=memory:// runs it against the in-memory backend.
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pathlib import Path
+
+from booking import SeatBookingService, BookingError
+from models import RideOffer, TripLocation
+from repositories import Storage, create_client
+
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def create_ride(storage: Storage, seats: int) -> str:
+    campus = TripLocation(latitude=40.7128, longitude=-74.0060, address="Campus")
+    downtown = TripLocation(latitude=40.7580, longitude=-73.9855, address="Downtown")
+    ride = RideOffer(
+        driver_id=f"bench-driver-{uuid.uuid4()}",
+        origin=campus,
+        destination=downtown,
+        departure_time=datetime.utcnow() + timedelta(hours=1),
+        available_seats=seats
+    )
+    return await storage.ride_offers.create(ride.dict(by_alias=True, exclude={'id'}))
+
+
+async def run_round(service: SeatBookingService, ride_id: str, riders: int, retries: int):
+    latencies = []
+    outcomes = {"held": 0, "rejected": 0, "replayed": 0, "in_progress": 0}
+    replayed_holds = []
+
+    async def attempt(user_id: str, key: str):
+        started = time.perf_counter()
+        try:
+            booking, created = await service.hold_seats(ride_id, user_id, 1, key)
+        except BookingError as e:
+            if e.status_code != 409:
+                raise
+            outcomes["in_progress"] += 1
+            return
+        finally:
+            latencies.append((time.perf_counter() - started) * 1000)
+        if not created:
+            outcomes["replayed"] += 1
+            if booking['status'] == "held":
+                replayed_holds.append(booking['_id'])
+        elif booking['status'] == "held":
+            outcomes["held"] += 1
+        else:
+            outcomes["rejected"] += 1
+
+    async def rider(index: int):
+        user_id = f"bench-rider-{index}"
+        key = str(uuid.uuid4())
+        # Retries race the original request, like a client that times out
+        # and resends while the first attempt is still in flight...
+        await asyncio.gather(*(attempt(user_id, key) for _ in range(1 + retries)))
+        # ...and one more once it has finished, which must replay its outcome
+        await attempt(user_id, key)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(rider(i) for i in range(riders)))
+    elapsed = time.perf_counter() - started
+
+    # A replay may only report a hold the original request really placed
+    false_holds = 0
+    for booking_id in replayed_holds:
+        booking = await service.bookings.get(booking_id)
+        false_holds += 0 if booking['status'] == "held" else 1
+    return outcomes, latencies, elapsed, false_holds
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Seat booking contention benchmark")
+    parser.add_argument("--riders", type=int, default=300, help="concurrent riders per round")
+    parser.add_argument("--seats", type=int, default=4, help="seats on the contended ride")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--retries", type=int, default=1,
+                        help="client retries per rider racing the first attempt, reusing its idempotency key; "
+                             "one more retry always follows once it has finished")
+    parser.add_argument("--latency-ms", type=float, default=1.0,
+                        help="extra delay on each seat reservation, keeps retries racing an "
+                             "in-flight request even on the in-memory backend")
+    args = parser.parse_args()
+
+    client = create_client(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[os.environ.get('BENCH_DB_NAME', 'ecocommute_bench')]
+    storage = Storage(db)
+    await storage.ensure_indexes()
+    service = SeatBookingService(storage)
+    if args.latency_ms:
+        reserve_seats = storage.ride_offers.reserve_seats
+
+        async def slow_reserve_seats(*reserve_args):
+            await asyncio.sleep(args.latency_ms / 1000)
+            return await reserve_seats(*reserve_args)
+
+        storage.ride_offers.reserve_seats = slow_reserve_seats
+
+    failures = 0
+    try:
+        for round_number in range(1, args.rounds + 1):
+            ride_id = await create_ride(storage, args.seats)
+            outcomes, latencies, elapsed, false_holds = await run_round(service, ride_id, args.riders, args.retries)
+
+            ride = await storage.ride_offers.get(ride_id)
+            held = await db.bookings.count_documents({"ride_id": ride_id, "status": "held"})
+            consistent = (
+                outcomes["held"] == args.seats == held == len(ride['passengers']) == len(ride['booking_ids'])
+                and outcomes["replayed"] == args.riders
+                and ride['available_seats'] == 0
+                and ride['status'] == "full"
+                and not false_holds
+            )
+            failures += 0 if consistent else 1
+
+            print(
+                f"round {round_number}: {len(latencies)} requests in {elapsed:.2f}s "
+                f"({len(latencies) / elapsed:.0f} req/s) | "
+                f"held={outcomes['held']} rejected={outcomes['rejected']} replayed={outcomes['replayed']} "
+                f"in_progress={outcomes['in_progress']} | "
+                f"p50={percentile(latencies, 50):.1f}ms p95={percentile(latencies, 95):.1f}ms "
+                f"p99={percentile(latencies, 99):.1f}ms | "
+                f"seats_left={ride['available_seats']} status={ride['status']} "
+                f"{'OK' if consistent else 'INCONSISTENT'}"
+            )
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+    if failures:
+        raise SystemExit(f"{failures} round(s) oversold, lost seats or replayed a false hold")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,197 @@
+from typing import Optional, Tuple
+from datetime import datetime, timedelta
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+from models import Booking
+from repositories import to_object_id
+
+
+class BookingError(Exception):
+    """Raised when a booking cannot be placed or transitioned"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class SeatBookingService:
+    """Lock-free seat reservations on ride offers.
+
+    Every seat change is a single conditional update on the ride document
+    (see `RideOfferRepository.reserve_seats`): the filter carries the seat
+    guard and the update applies the `$inc` and `$push`/`$pull`, so concurrent
+    riders can never oversell a ride. Seats are tied to the booking's id in
+    the ride's `booking_ids`, so a booking only ever releases the seats it
+    took and releasing is safe to repeat.
+    """
+
+    def __init__(self, storage):
+        self.rides = storage.ride_offers
+        self.bookings = storage.bookings
+        self.HOLD_MINUTES = 10
+        self.SWEEP_BATCH_SIZE = 100
+
+    # ----- seat accounting on the ride document -----
+
+    async def _reserve_seats(self, booking: dict) -> Optional[dict]:
+        """Atomically take a booking's seats from its ride, or return None"""
+        ride_id = booking['ride_id']
+        ride = await self.rides.reserve_seats(ride_id, booking['user_id'], booking['seats'], booking['_id'])
+        if ride and ride['available_seats'] <= 0:
+            # Only flips while the ride is still sold out, so a release that
+            # lands in between leaves the ride available.
+            await self.rides.mark_full(ride_id)
+        return ride
+
+    async def _release_seats(self, booking: dict) -> bool:
+        """Atomically give a booking's seats back; a no-op if it holds none"""
+        ride_id = booking['ride_id']
+        ride = await self.rides.release_seats(ride_id, booking['user_id'], booking['seats'], booking['_id'])
+        if not ride:
+            return False
+        if ride['available_seats'] > 0:
+            await self.rides.mark_available(ride_id)
+        return True
+
+    # ----- booking lifecycle -----
+
+    async def hold_seats(self, ride_id: str, user_id: str, seats: int = 1,
+                         idempotency_key: Optional[str] = None) -> Tuple[dict, bool]:
+        """Place a hold on seats of a ride.
+
+        Returns the booking document and whether it was created by this call;
+        a retry with the same idempotency key returns the original booking.
+        """
+        if seats < 1:
+            raise BookingError(400, "At least one seat must be booked")
+        if to_object_id(ride_id) is None:
+            raise BookingError(404, "Ride not found")
+
+        now = datetime.utcnow()
+        booking = Booking(
+            ride_id=ride_id,
+            user_id=user_id,
+            seats=seats,
+            idempotency_key=idempotency_key or str(uuid.uuid4()),
+            expires_at=now + timedelta(minutes=self.HOLD_MINUTES),
+            created_at=now,
+            updated_at=now
+        ).dict(by_alias=True, exclude={'id'})
+
+        # Claim the idempotency key before touching the ride so that a
+        # retried request can never reserve seats twice. The booking stays
+        # `pending` until the seats are actually taken, so a concurrent retry
+        # can never report a hold that may still be rejected.
+        try:
+            booking['_id'] = await self.bookings.create(booking)
+        except DuplicateKeyError:
+            existing = await self.bookings.get_by_idempotency_key(user_id, booking['idempotency_key'])
+            if existing['ride_id'] != ride_id or existing['seats'] != seats:
+                raise BookingError(422, "Idempotency key was already used for a different booking")
+            if existing['status'] == "pending":
+                raise BookingError(409, "Booking is still being processed, retry shortly")
+            return existing, False
+
+        if await self._reserve_seats(booking):
+            booking = await self.bookings.transition(
+                booking['_id'], ["pending"],
+                {"status": "held", "updated_at": datetime.utcnow()}
+            )
+            return booking, True
+
+        reason = await self._rejection_reason(ride_id, user_id)
+        if reason is None:
+            # Nothing to replay for a ride that does not exist
+            await self.bookings.delete(booking['_id'])
+            raise BookingError(404, "Ride not found")
+        booking = await self.bookings.transition(
+            booking['_id'], ["pending"],
+            {"status": "rejected", "rejection_reason": reason,
+             "expires_at": None, "updated_at": datetime.utcnow()}
+        )
+        return booking, True
+
+    async def _rejection_reason(self, ride_id: str, user_id: str) -> Optional[str]:
+        """Explain why `reserve_seats` refused, or None if the ride does not exist"""
+        ride = await self.rides.get(ride_id)
+        if not ride:
+            return None
+        if ride['status'] not in ("available", "full") or ride['departure_time'] <= datetime.utcnow():
+            return "Ride has departed or is no longer available"
+        if user_id in ride.get('passengers', []):
+            return "You already have seats on this ride"
+        return "Not enough seats available on this ride"
+
+    async def confirm_booking(self, booking_id: str, user_id: str) -> dict:
+        """Turn an unexpired hold into a confirmed booking"""
+        if to_object_id(booking_id) is None:
+            raise BookingError(404, "Booking not found")
+
+        now = datetime.utcnow()
+        booking = await self.bookings.transition(
+            booking_id, ["held"],
+            {"status": "confirmed", "expires_at": None, "updated_at": now},
+            conditions={"user_id": user_id, "expires_at": {"$gt": now}}
+        )
+        if booking:
+            return booking
+
+        existing = await self.bookings.get(booking_id, user_id)
+        if not existing:
+            raise BookingError(404, "Booking not found")
+        if existing['status'] == "confirmed":
+            return existing
+        if existing['status'] == "held":
+            # Past its deadline but not yet swept
+            await self._expire_hold(existing)
+            raise BookingError(409, "Seat hold has expired")
+        raise BookingError(409, f"Booking is {existing['status']}")
+
+    async def cancel_booking(self, booking_id: str, user_id: str) -> dict:
+        """Cancel a held or confirmed booking and release its seats"""
+        if to_object_id(booking_id) is None:
+            raise BookingError(404, "Booking not found")
+
+        booking = await self.bookings.transition(
+            booking_id, ["held", "confirmed"],
+            {"status": "cancelled", "expires_at": None, "updated_at": datetime.utcnow()},
+            conditions={"user_id": user_id}
+        )
+        if not booking:
+            existing = await self.bookings.get(booking_id, user_id)
+            if not existing:
+                raise BookingError(404, "Booking not found")
+            if existing['status'] == "cancelled":
+                return existing
+            raise BookingError(409, f"Booking is {existing['status']}")
+
+        await self._release_seats(booking)
+        return booking
+
+    async def _expire_hold(self, booking: dict) -> bool:
+        """Expire one hold; only the caller that wins the transition releases seats"""
+        expired = await self.bookings.transition(
+            booking['_id'], ["pending", "held"],
+            {"status": "expired", "updated_at": datetime.utcnow()}
+        )
+        if not expired:
+            return False
+        await self._release_seats(expired)
+        return True
+
+    async def release_expired_holds(self, now: Optional[datetime] = None) -> int:
+        """Expire holds past their deadline in batches and return their seats"""
+        now = now or datetime.utcnow()
+        released = 0
+        while True:
+            batch = await self.bookings.list_expired_holds(now, self.SWEEP_BATCH_SIZE)
+            if not batch:
+                return released
+            for booking in batch:
+                if await self._expire_hold(booking):
+                    released += 1
+            if len(batch) < self.SWEEP_BATCH_SIZE:
+                return released
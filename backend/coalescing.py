@@ -0,0 +1,132 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+from collections import deque
+import asyncio
+import time
+
+
+class SingleFlight:
+    """Share one in-flight call per key between concurrent callers.
+
+    The result is also kept for `ttl_seconds`, so a burst of identical reads
+    costs one query. Results are shared between callers and must be treated
+    as read-only.
+    """
+
+    def __init__(self, ttl_seconds: float = 1.0):
+        self.ttl_seconds = ttl_seconds
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._cache: Dict[Hashable, Tuple[float, Any]] = {}
+        self._generation = 0
+        self.loads = 0
+        self.hits = 0
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.loads += 1
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, generation=self._generation: self._finish(key, t, generation))
+        else:
+            self.hits += 1
+        # Shielded so a caller going away does not cancel the shared load
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task, generation: int):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # A load that started before an invalidation may carry stale data
+        if not task.cancelled() and task.exception() is None and generation == self._generation:
+            self._cache[key] = (time.monotonic() + self.ttl_seconds, task.result())
+
+    def invalidate(self):
+        """Drop cached results after a write; loads already running are not cached"""
+        self._generation += 1
+        self._cache.clear()
+        self._inflight.clear()
+
+
+class Overloaded(Exception):
+    """Raised when a request waited too long for an admission slot"""
+
+    def __init__(self, name: str, retry_after_seconds: int = 1):
+        super().__init__(f"{name} is overloaded")
+        self.name = name
+        self.retry_after_seconds = retry_after_seconds
+
+
+class AdmissionController:
+    """Per-endpoint concurrency limit with queue-time based load shedding.
+
+    At most `max_concurrency` requests run at once; the rest wait in FIFO
+    order. A request that cannot start within `max_queue_seconds`, or that
+    arrives when `max_queue` requests are already waiting, is shed with
+    `Overloaded` instead of adding to the tail latency of everyone else.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue_seconds: float,
+                 max_queue: int = 1000):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_seconds = max_queue_seconds
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiters: deque = deque()
+        self.admitted = 0
+        self.shed = 0
+
+    async def acquire(self):
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            raise Overloaded(self.name)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_queue_seconds)
+        except asyncio.TimeoutError:
+            if not (waiter.done() and not waiter.cancelled()):
+                self._discard(waiter)
+                self.shed += 1
+                raise Overloaded(self.name)
+            # release() handed us the slot in the same iteration the timeout
+            # fired (wait_for reports the timeout on 3.12+), so we are admitted
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up, pass it on
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        self.admitted += 1
+
+    def release(self):
+        # Hand the slot straight to the oldest live waiter
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def _discard(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
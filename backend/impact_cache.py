@@ -0,0 +1,118 @@
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+import copy
+import time
+
+
+def _parent(doc: dict, path: str) -> Tuple[dict, str]:
+    """Container and key for a flat or dotted field path"""
+    *parents, key = path.split('.')
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    return doc, key
+
+
+class ImpactCache:
+    """Per-user LRU cache of carbon impact documents.
+
+    Entries are kept current by replaying the same `$inc` deltas that
+    `record_trip_impact` sends to the database. Every write bumps the
+    document's `version`, and a delta is only applied to the entry it was
+    computed against (version - 1); anything else evicts the entry.
+
+    A user's impact only changes through their own trips, so a client that
+    sends the last version it knows (`client_version`) proves that an entry
+    at or above it is current; such entries are served for up to
+    `max_age_seconds`. Without that proof, writes through another worker
+    could have made the entry stale, so it is only served for `ttl_seconds`
+    and then revalidated against the stored version (see `stale_version`
+    and `revalidate`).
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 2.0,
+                 max_age_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_age_seconds = max_age_seconds
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._checked_at: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: str, client_version: Optional[int] = None) -> Optional[dict]:
+        """A copy of the entry, if it can be served without asking the database"""
+        entry = self._entries.get(user_id)
+        if entry is None or not self._is_fresh(user_id, entry, client_version):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return copy.deepcopy(entry)
+
+    def _is_fresh(self, user_id: str, entry: dict, client_version: Optional[int]) -> bool:
+        age = time.monotonic() - self._checked_at[user_id]
+        if client_version is None:
+            return age < self.ttl_seconds
+        return entry.get('version', 0) >= client_version and age < self.max_age_seconds
+
+    def stale_version(self, user_id: str, client_version: Optional[int] = None) -> Optional[int]:
+        """Version of an entry that `get` refused only because it aged out"""
+        entry = self._entries.get(user_id)
+        if entry is None or entry.get('version', 0) < (client_version or 0):
+            return None
+        return entry.get('version', 0)
+
+    def revalidate(self, user_id: str, stored_version: Optional[int]) -> Optional[dict]:
+        """Serve an aged-out entry again if the database still has its version"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if stored_version is None or entry.get('version', 0) != stored_version:
+            self.invalidate(user_id)
+            return None
+        self.revalidations += 1
+        self._touch(user_id)
+        return copy.deepcopy(entry)
+
+    def _touch(self, user_id: str):
+        self._checked_at[user_id] = time.monotonic()
+        self._entries.move_to_end(user_id)
+
+    def put(self, impact: dict):
+        """Cache a document read from the database, never replacing a newer one"""
+        user_id = impact['user_id']
+        cached = self._entries.get(user_id)
+        if cached is not None and cached.get('version', 0) > impact.get('version', 0):
+            return
+        self._entries[user_id] = copy.deepcopy(impact)
+        self._touch(user_id)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            del self._checked_at[evicted]
+
+    def apply_deltas(self, user_id: str, version: int, deltas: Dict[str, float],
+                     fields: Optional[dict] = None):
+        """Replay a write that moved the document to `version`"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        if entry.get('version', 0) != version - 1:
+            # Missed a write (or raced with one), refetch on next read
+            self.invalidate(user_id)
+            return
+        # The same `$inc` and `$set` the repository sent
+        for path, delta in deltas.items():
+            parent, key = _parent(entry, path)
+            parent[key] = parent.get(key, 0) + delta
+        for path, value in dict(fields or {}, version=version).items():
+            parent, key = _parent(entry, path)
+            parent[key] = value
+        self._touch(user_id)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+        self._checked_at.pop(user_id, None)
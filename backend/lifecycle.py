@@ -0,0 +1,63 @@
+from typing import Dict, Optional
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LifecycleSweeper:
+    """Background expiry of stale ride offers, trip requests and seat holds.
+
+    Offers still open after departure and requests still searching after
+    their departure window are marked `expired` in batches, so the working
+    set that matching and listing scan tracks current demand. Expired
+    documents are deleted by the partial TTL indexes after the retention
+    period.
+    """
+
+    def __init__(self, storage, booking_service):
+        self.storage = storage
+        self.booking_service = booking_service
+        self.SWEEP_INTERVAL_SECONDS = 30
+        self.BATCH_SIZE = 500
+        self.OFFER_GRACE_MINUTES = 5  # let a driver run a little late before expiring
+        self.REQUEST_GRACE_MINUTES = 30  # matches RideMatchingEngine.MAX_TIME_WINDOW_MINUTES
+        self.RETENTION = timedelta(days=30)  # how long expired documents are kept
+
+    async def _drain(self, expire_batch) -> int:
+        """Run one repository expiry in batches until nothing is left"""
+        total = 0
+        while True:
+            expired = await expire_batch()
+            total += expired
+            if expired < self.BATCH_SIZE:
+                return total
+            # Give request handlers a turn between batches
+            await asyncio.sleep(0)
+
+    async def sweep(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Run one expiry pass and return how many items each step expired"""
+        now = now or datetime.utcnow()
+        offer_cutoff = now - timedelta(minutes=self.OFFER_GRACE_MINUTES)
+        request_cutoff = now - timedelta(minutes=self.REQUEST_GRACE_MINUTES)
+
+        return {
+            "ride_offers": await self._drain(lambda: self.storage.ride_offers.expire_departed(
+                offer_cutoff, now, self.RETENTION, self.BATCH_SIZE
+            )),
+            "trip_requests": await self._drain(lambda: self.storage.trip_requests.expire_departed(
+                request_cutoff, now, self.RETENTION, self.BATCH_SIZE
+            )),
+            "seat_holds": await self.booking_service.release_expired_holds(now)
+        }
+
+    async def run_forever(self):
+        while True:
+            try:
+                expired = await self.sweep()
+                if any(expired.values()):
+                    logger.info(f"Lifecycle sweep expired {expired}")
+            except Exception:
+                logger.exception("Lifecycle sweep failed")
+            await asyncio.sleep(self.SWEEP_INTERVAL_SECONDS)
@@ -0,0 +1,434 @@
+"""Async load generator for the EcoCommute API.
+
+Drives a mixed workload (register/login, ride offers, trip requests, bookings
+and impact recording) at several concurrency levels and reports throughput,
+error rates and latency percentiles per endpoint.
+
+    # in-process against the in-memory Mongo stand-in
+    python load_test.py --concurrency 1,16,64 --duration 10
+
+    # spawn uvicorn on localhost (use a real MONGO_URL for more than one worker)
+    python load_test.py --spawn-server --workers 4 --mongo-url mongodb://localhost:27017
+
+    # an already running server
+    python load_test.py --base-url http://127.0.0.1:8001
+
+In-process runs also sample event loop lag, which is where blocking work on
+the loop (bcrypt, matching) shows up first.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT_DIR = Path(__file__).parent
+
+# Campus the synthetic trips are scattered around
+CAMPUS = (40.7128, -74.0060)
+DOWNTOWN = (40.7580, -73.9855)
+
+# Relative weight of each scenario in the steady-state mix
+SCENARIO_WEIGHTS = {
+    "login": 1,
+    "me": 2,
+    "offer_ride": 1,
+    "available_rides": 4,
+    "request_trip": 3,
+    "book_ride": 1,
+    "record_trip": 2,
+    "impact": 4,
+}
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def jitter(point: Tuple[float, float], km: float) -> dict:
+    # ~111km per degree is close enough for a load generator
+    spread = km / 111.0
+    return {
+        "latitude": point[0] + random.uniform(-spread, spread),
+        "longitude": point[1] + random.uniform(-spread, spread),
+        "address": "Load test location"
+    }
+
+
+def iso_timestamp(moment: datetime) -> str:
+    """UTC timestamp the way the app sends it, like JS `Date.toISOString()`"""
+    moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+
+# ============= TRANSPORTS =============
+class InProcessTransport:
+    """Calls the ASGI app directly, without sockets"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body: Optional[dict] = None,
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, Optional[dict]]:
+        payload = json.dumps(body, default=str).encode() if body is not None else b""
+        raw_headers = [(b"host", b"loadtest"), (b"content-type", b"application/json"),
+                       (b"content-length", str(len(payload)).encode())]
+        raw_headers += [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": raw_headers,
+            "client": ("127.0.0.1", 0),
+            "server": ("loadtest", 80),
+        }
+        sent = False
+        status = 500
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        data = b"".join(chunks)
+        return status, json.loads(data) if data else None
+
+    async def close(self):
+        pass
+
+
+class HttpTransport:
+    """Talks to a running server over HTTP"""
+
+    def __init__(self, base_url: str, connections: int):
+        import aiohttp
+        self.base_url = base_url.rstrip('/')
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections))
+
+    async def request(self, method: str, path: str, body: Optional[dict] = None,
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, Optional[dict]]:
+        data = json.dumps(body, default=str) if body is not None else None
+        all_headers = {"content-type": "application/json", **(headers or {})}
+        async with self.session.request(method, self.base_url + path, data=data, headers=all_headers) as response:
+            text = await response.text()
+            return response.status, json.loads(text) if text else None
+
+    async def close(self):
+        await self.session.close()
+
+
+# ============= METRICS =============
+class EndpointStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.client_errors = 0
+        self.server_errors = 0
+        self.shed = 0
+
+    def record(self, latency_ms: float, status: int):
+        self.latencies.append(latency_ms)
+        if status == 503:
+            # Load shedding, the server is protecting its latency
+            self.shed += 1
+        elif status >= 500:
+            self.server_errors += 1
+        elif status >= 400:
+            self.client_errors += 1
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes a sleeping task"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, (time.perf_counter() - started - self.interval) * 1000))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+# ============= VIRTUAL USERS =============
+class VirtualUser:
+    def __init__(self, transport, stats: Dict[str, EndpointStats], is_driver: bool):
+        self.transport = transport
+        self.stats = stats
+        self.is_driver = is_driver
+        self.email = f"load-{uuid.uuid4().hex[:12]}@campus.edu"
+        self.password = "load-test-password"
+        self.token = None
+
+    async def call(self, label: str, method: str, path: str, body: Optional[dict] = None,
+                   extra_headers: Optional[Dict[str, str]] = None):
+        headers = {"authorization": f"Bearer {self.token}"} if self.token else {}
+        headers.update(extra_headers or {})
+        started = time.perf_counter()
+        try:
+            status, data = await self.transport.request(method, path, body, headers)
+        except Exception:
+            status, data = 599, None
+        self.stats[label].record((time.perf_counter() - started) * 1000, status)
+        return status, data
+
+    async def setup(self):
+        status, data = await self.call("POST /api/auth/register", "POST", "/api/auth/register", {
+            "email": self.email,
+            "password": self.password,
+            "full_name": "Load Tester",
+            "university": "Load Test University"
+        })
+        if status == 200:
+            self.token = data["access_token"]
+        if self.is_driver and self.token:
+            await self.call("PUT /api/profile", "PUT", "/api/profile", {"is_driver": True})
+
+    def _trip(self) -> dict:
+        return {
+            "origin": jitter(CAMPUS, 1.0),
+            "destination": jitter(DOWNTOWN, 1.0),
+            "departure_time": iso_timestamp(
+                datetime.now(timezone.utc) + timedelta(minutes=random.randint(30, 90))
+            ),
+        }
+
+    async def run_scenario(self, name: str):
+        if name == "login":
+            await self.call("POST /api/auth/login", "POST", "/api/auth/login",
+                            {"email": self.email, "password": self.password})
+        elif name == "me":
+            await self.call("GET /api/auth/me", "GET", "/api/auth/me")
+        elif name == "offer_ride":
+            if not self.is_driver:
+                return await self.run_scenario("available_rides")
+            await self.call("POST /api/rides/offer", "POST", "/api/rides/offer",
+                            {**self._trip(), "driver_id": "", "available_seats": random.randint(1, 4)})
+        elif name == "available_rides":
+            await self.call("GET /api/rides/available", "GET", "/api/rides/available")
+        elif name == "request_trip":
+            await self.call("POST /api/trips/request", "POST", "/api/trips/request",
+                            {**self._trip(), "user_id": ""})
+        elif name == "book_ride":
+            status, rides = await self.call("GET /api/rides/available", "GET", "/api/rides/available")
+            if status == 200 and rides:
+                ride = random.choice(rides)
+                await self.call("POST /api/rides/{ride_id}/book", "POST", f"/api/rides/{ride['_id']}/book",
+                                {"seats": 1}, {"idempotency-key": str(uuid.uuid4())})
+        elif name == "record_trip":
+            await self.call("POST /api/impact/record-trip", "POST", "/api/impact/record-trip", {
+                "mode": random.choice(["carpool", "transit", "bike", "walk"]),
+                "distance_km": round(random.uniform(2, 25), 1),
+                "passengers": random.randint(1, 4)
+            })
+        elif name == "impact":
+            await self.call("GET /api/impact", "GET", "/api/impact")
+
+    async def run(self, deadline: float):
+        scenarios = list(SCENARIO_WEIGHTS)
+        weights = list(SCENARIO_WEIGHTS.values())
+        while time.perf_counter() < deadline:
+            await self.run_scenario(random.choices(scenarios, weights)[0])
+
+
+async def run_level(transport, concurrency: int, duration: float, driver_ratio: float,
+                    measure_loop_lag: bool) -> dict:
+    stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+    setup_stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+    users = [VirtualUser(transport, setup_stats, random.random() < driver_ratio) for _ in range(concurrency)]
+
+    # Registration is bcrypt-bound, keep it out of the measured window
+    setup_started = time.perf_counter()
+    await asyncio.gather(*(user.setup() for user in users))
+    setup_elapsed = time.perf_counter() - setup_started
+    for user in users:
+        user.stats = stats
+
+    monitor = LoopLagMonitor() if measure_loop_lag else None
+    if monitor:
+        monitor.start()
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(user.run(deadline) for user in users))
+    elapsed = time.perf_counter() - started
+
+    if monitor:
+        await monitor.stop()
+
+    report = {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "setup": {
+            "elapsed_s": round(setup_elapsed, 2),
+            "requests": sum(len(e.latencies) for e in setup_stats.values()),
+            "errors": sum(e.client_errors + e.server_errors + e.shed for e in setup_stats.values()),
+        },
+        "endpoints": {},
+    }
+    for label, endpoint in sorted(stats.items()):
+        count = len(endpoint.latencies)
+        report["endpoints"][label] = {
+            "requests": count,
+            "rps": round(count / elapsed, 1),
+            "client_errors": endpoint.client_errors,
+            "server_errors": endpoint.server_errors,
+            "shed": endpoint.shed,
+            "error_rate": round(endpoint.server_errors / count, 4) if count else 0.0,
+            "p50_ms": round(percentile(endpoint.latencies, 50), 2),
+            "p90_ms": round(percentile(endpoint.latencies, 90), 2),
+            "p99_ms": round(percentile(endpoint.latencies, 99), 2),
+            "max_ms": round(max(endpoint.latencies, default=0.0), 2),
+        }
+    total = sum(e["requests"] for e in report["endpoints"].values())
+    report["total_requests"] = total
+    report["total_rps"] = round(total / elapsed, 1)
+    if monitor:
+        report["loop_lag_p99_ms"] = round(percentile(monitor.samples, 99), 2)
+        report["loop_lag_max_ms"] = round(max(monitor.samples, default=0.0), 2)
+    return report
+
+
+def print_report(report: dict):
+    header = f"{'endpoint':34} {'reqs':>7} {'rps':>8} {'4xx':>6} {'5xx':>6} {'shed':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"
+    print(f"\n=== concurrency {report['concurrency']}: {report['total_requests']} requests, "
+          f"{report['total_rps']} req/s in {report['elapsed_s']}s ===")
+    setup = report["setup"]
+    print(f"setup (not measured): {setup['requests']} requests, {setup['errors']} errors in {setup['elapsed_s']}s")
+    if "loop_lag_p99_ms" in report:
+        print(f"event loop lag: p99={report['loop_lag_p99_ms']}ms max={report['loop_lag_max_ms']}ms")
+    print(header)
+    for label, e in report["endpoints"].items():
+        print(f"{label:34} {e['requests']:>7} {e['rps']:>8} {e['client_errors']:>6} {e['server_errors']:>6} {e['shed']:>6} "
+              f"{e['p50_ms']:>8} {e['p90_ms']:>8} {e['p99_ms']:>8} {e['max_ms']:>8}")
+
+
+# ============= SERVER MODES =============
+async def wait_for_server(base_url: str, timeout: float = 30.0):
+    import aiohttp
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            try:
+                async with session.get(base_url + "/api/") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up within {timeout}s")
+
+
+def spawn_server(port: int, workers: int, mongo_url: str) -> subprocess.Popen:
+    env = dict(os.environ, MONGO_URL=mongo_url)
+    env.setdefault("DB_NAME", "ecocommute_loadtest")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="EcoCommute API load generator")
+    parser.add_argument("--concurrency", default="1,8,32,128",
+                        help="comma separated virtual user counts, one run per level")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of steady load per level")
+    parser.add_argument("--driver-ratio", type=float, default=0.3)
+    parser.add_argument("--base-url", help="target an already running server instead of the in-process app")
+    parser.add_argument("--spawn-server", action="store_true", help="start uvicorn on localhost for the run")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--mongo-url", default="memory://",
+                        help="MONGO_URL for in-process and spawned servers")
+    parser.add_argument("--json", dest="json_path", help="also write the reports to this file")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    process = None
+    if args.spawn_server:
+        if args.mongo_url.startswith("memory://") and args.workers > 1:
+            print("memory:// is per process, running a single worker", file=sys.stderr)
+            args.workers = 1
+        process = spawn_server(args.port, args.workers, args.mongo_url)
+        args.base_url = f"http://127.0.0.1:{args.port}"
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    reports = []
+    try:
+        if args.base_url:
+            await wait_for_server(args.base_url)
+            transport = HttpTransport(args.base_url, max(levels))
+            in_process = False
+        else:
+            os.environ["MONGO_URL"] = args.mongo_url
+            os.environ.setdefault("DB_NAME", "ecocommute_loadtest")
+            sys.path.insert(0, str(ROOT_DIR))
+            import server
+            await server.app.router.startup()
+            transport = InProcessTransport(server.app)
+            in_process = True
+
+        try:
+            for level in levels:
+                report = await run_level(transport, level, args.duration, args.driver_ratio, in_process)
+                print_report(report)
+                reports.append(report)
+        finally:
+            await transport.close()
+            if in_process:
+                await server.app.router.shutdown()
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,570 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timezone
+import copy
+import time
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+
+
+_MISSING = object()
+
+# Seconds between passes that delete documents expired by TTL indexes
+TTL_MONITOR_INTERVAL_SECONDS = 1.0
+
+
+def _bson_copy(value: Any) -> Any:
+    """Deep copy a value the way a BSON round trip stores it.
+
+    Aware datetimes become naive UTC, matching what Motor returns.
+    """
+    if isinstance(value, dict):
+        return {k: _bson_copy(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_bson_copy(v) for v in value]
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return copy.deepcopy(value)
+
+
+def _resolve(doc: Any, path: str) -> List[Any]:
+    """Return every value a dotted path reaches, fanning out over arrays"""
+    values = [doc]
+    for part in path.split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    next_values.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    next_values.append(value[int(part)])
+                else:
+                    next_values.extend(
+                        item[part] for item in value if isinstance(item, dict) and part in item
+                    )
+        values = next_values
+    return values
+
+
+def _equals(candidates: List[Any], expected: Any) -> bool:
+    if not candidates:
+        return expected is None
+    for value in candidates:
+        if value == expected:
+            return True
+        if isinstance(value, list) and expected in value:
+            return True
+    return False
+
+
+def _compare(candidates: List[Any], expected: Any, op) -> bool:
+    for value in candidates:
+        for item in (value if isinstance(value, list) else [value]):
+            try:
+                if item is not None and op(item, expected):
+                    return True
+            except TypeError:
+                continue
+    return False
+
+
+_COMPARISONS = {
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+}
+
+
+def _match_condition(candidates: List[Any], condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+        for op, expected in condition.items():
+            if op == '$eq':
+                ok = _equals(candidates, expected)
+            elif op == '$ne':
+                ok = not _equals(candidates, expected)
+            elif op == '$in':
+                ok = any(_equals(candidates, item) for item in expected)
+            elif op == '$nin':
+                ok = not any(_equals(candidates, item) for item in expected)
+            elif op == '$exists':
+                ok = bool(candidates) == bool(expected)
+            elif op in _COMPARISONS:
+                ok = _compare(candidates, expected, _COMPARISONS[op])
+            elif op == '$not':
+                ok = not _match_condition(candidates, expected)
+            else:
+                raise NotImplementedError(f"Query operator {op} is not supported in memory")
+            if not ok:
+                return False
+        return True
+    return _equals(candidates, condition)
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    """Evaluate a Mongo query document against a document"""
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        elif not _match_condition(_resolve(doc, key), condition):
+            return False
+    return True
+
+
+def _parent(doc: dict, path: str, create: bool) -> Tuple[Optional[dict], str]:
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if part not in doc or not isinstance(doc[part], dict):
+            if not create:
+                return None, parts[-1]
+            doc[part] = {}
+        doc = doc[part]
+    return doc, parts[-1]
+
+
+def _get(doc: dict, path: str) -> Any:
+    parent, leaf = _parent(doc, path, create=False)
+    if parent is None:
+        return _MISSING
+    return parent.get(leaf, _MISSING)
+
+
+def _set(doc: dict, path: str, value: Any):
+    parent, leaf = _parent(doc, path, create=True)
+    parent[leaf] = _bson_copy(value)
+
+
+def _pull_matches(item: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+        return _match_condition([item], condition)
+    if isinstance(condition, dict) and isinstance(item, dict):
+        return matches(item, condition)
+    return item == condition
+
+
+def apply_update(doc: dict, update: dict, inserting: bool = False):
+    """Apply a Mongo update document to `doc` in place"""
+    if not any(key.startswith('$') for key in update):
+        _id = doc.get('_id')
+        doc.clear()
+        doc.update(_bson_copy(update))
+        if _id is not None:
+            doc['_id'] = _id
+        return
+
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == '$set':
+                _set(doc, path, value)
+            elif op == '$setOnInsert':
+                if inserting:
+                    _set(doc, path, value)
+            elif op == '$unset':
+                parent, leaf = _parent(doc, path, create=False)
+                if parent is not None:
+                    parent.pop(leaf, None)
+            elif op == '$inc':
+                current = _get(doc, path)
+                _set(doc, path, (0 if current is _MISSING else current) + value)
+            elif op in ('$push', '$addToSet'):
+                current = _get(doc, path)
+                items = current if current is not _MISSING else []
+                new_items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                for item in new_items:
+                    if op == '$push' or item not in items:
+                        items.append(_bson_copy(item))
+                _set(doc, path, items)
+            elif op == '$pull':
+                current = _get(doc, path)
+                if isinstance(current, list):
+                    _set(doc, path, [item for item in current if not _pull_matches(item, value)])
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported in memory")
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include_id = projection.get('_id', 1)
+    fields = {k: v for k, v in projection.items() if k != '_id'}
+    if all(fields.values()) and (fields or include_id):
+        projected = {k: doc[k] for k in fields if k in doc}
+        if include_id and '_id' in doc:
+            projected['_id'] = doc['_id']
+        return projected
+    for key in fields:
+        doc.pop(key, None)
+    if not include_id:
+        doc.pop('_id', None)
+    return doc
+
+
+def _value_or_none(doc: dict, path: str) -> Any:
+    value = _get(doc, path)
+    return None if value is _MISSING else value
+
+
+def _sort_key(value: Any):
+    # None sorts first, as in Mongo; mixed types fall back to their name
+    return (value is not None, type(value).__name__ if value is not None else '', value)
+
+
+class InMemoryCursor:
+    def __init__(self, docs: List[dict], projection: Optional[dict] = None):
+        self._docs = docs
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1):
+        self._sort = list(key) if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _materialize(self, length: Optional[int] = None) -> List[dict]:
+        docs = self._docs
+        for key, direction in reversed(self._sort):
+            docs = sorted(docs, key=lambda d: _sort_key(_value_or_none(d, key)), reverse=direction < 0)
+        docs = docs[self._skip:]
+        limits = [n for n in (self._limit, length) if n]
+        if limits:
+            docs = docs[:min(limits)]
+        return [_project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return self._materialize(length)
+
+    def __aiter__(self):
+        self._iter = iter(self._materialize())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def _is_equality(condition: Any) -> bool:
+    if isinstance(condition, dict):
+        return set(condition) == {'$eq'} and _hashable(condition['$eq'])
+    return _hashable(condition)
+
+
+def _equality_value(condition: Any) -> Any:
+    return condition['$eq'] if isinstance(condition, dict) else condition
+
+
+def _hashable(value: Any) -> bool:
+    return not isinstance(value, (list, dict))
+
+
+class _Index:
+    """Hash index from field values to document ids.
+
+    Like a Mongo compound index it can answer queries on any prefix of its
+    fields. Documents whose indexed fields hold arrays or sub-documents are
+    kept aside and always returned as candidates, so lookups never miss them.
+    """
+
+    def __init__(self, name: str, fields: Tuple[str, ...], unique: bool):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.entries: Dict[tuple, set] = {}
+        self.unkeyed: set = set()
+
+    def key(self, doc: dict) -> Optional[tuple]:
+        key = tuple(_value_or_none(doc, field) for field in self.fields)
+        return key if all(_hashable(value) for value in key) else None
+
+    def check(self, doc: dict):
+        if not self.unique:
+            return
+        key = self.key(doc)
+        owners = self.entries.get(key, ()) if key is not None else ()
+        if any(owner != doc['_id'] for owner in owners):
+            raise DuplicateKeyError(f"E11000 duplicate key error index: {self.name} dup key: {key}")
+
+    def add(self, doc: dict):
+        key = self.key(doc)
+        if key is None:
+            self.unkeyed.add(doc['_id'])
+            return
+        # Entries are kept for every prefix of the key
+        for length in range(1, len(key) + 1):
+            self.entries.setdefault(key[:length], set()).add(doc['_id'])
+
+    def remove(self, doc: dict):
+        key = self.key(doc)
+        if key is None:
+            self.unkeyed.discard(doc['_id'])
+            return
+        for length in range(1, len(key) + 1):
+            ids = self.entries.get(key[:length])
+            if ids is not None:
+                ids.discard(doc['_id'])
+                if not ids:
+                    del self.entries[key[:length]]
+
+    def lookup(self, key: tuple) -> set:
+        ids = self.entries.get(key, set())
+        return ids | self.unkeyed if self.unkeyed else ids
+
+
+class InMemoryCollection:
+    """A Motor-compatible collection kept in process memory.
+
+    Every operation runs to completion without yielding to the event loop,
+    so single-document updates are atomic just like they are in Mongo.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        self._seq: Dict[Any, int] = {}
+        self._next_seq = 0
+        self._indexes: Dict[str, _Index] = {}
+        self._ttl: List[Tuple[str, float, dict]] = []
+        self._ttl_checked = 0.0
+
+    # ----- indexes -----
+
+    async def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        fields = tuple(field for field, _ in keys)
+        name = name or '_'.join(f"{field}_{direction}" for field, direction in keys)
+        if 'expireAfterSeconds' in kwargs and name not in self._indexes:
+            self._ttl.append((fields[0], kwargs['expireAfterSeconds'], kwargs.get('partialFilterExpression') or {}))
+        if name not in self._indexes:
+            index = _Index(name, fields, unique)
+            for doc in self._docs.values():
+                index.check(doc)
+                index.add(doc)
+            self._indexes[name] = index
+        return name
+
+    def _check_unique(self, doc: dict):
+        for index in self._indexes.values():
+            index.check(doc)
+
+    def _index(self, doc: dict):
+        for index in self._indexes.values():
+            index.add(doc)
+
+    def _unindex(self, doc: dict):
+        for index in self._indexes.values():
+            index.remove(doc)
+
+    def _expire_ttl(self):
+        """Delete documents past their TTL, like Mongo's background TTL monitor"""
+        if not self._ttl or time.monotonic() - self._ttl_checked < TTL_MONITOR_INTERVAL_SECONDS:
+            return
+        self._ttl_checked = time.monotonic()
+        now = datetime.utcnow()
+        for field, seconds, partial in self._ttl:
+            for doc in list(self._docs.values()):
+                value = _get(doc, field)
+                if (isinstance(value, datetime) and (now - value).total_seconds() >= seconds
+                        and matches(doc, partial)):
+                    self._drop(doc)
+
+    def _candidate_ids(self, query: dict) -> Optional[Iterable]:
+        """Pick the narrowest index the query pins down by equality"""
+        if '_id' in query and _is_equality(query['_id']):
+            return [_equality_value(query['_id'])]
+        if '_id' in query and isinstance(query['_id'], dict) and set(query['_id']) == {'$in'}:
+            return list(dict.fromkeys(query['_id']['$in']))
+        best = None
+        for index in self._indexes.values():
+            prefix = []
+            for field in index.fields:
+                if field not in query or not _is_equality(query[field]):
+                    break
+                prefix.append(_equality_value(query[field]))
+            if not prefix:
+                continue
+            ids = index.lookup(tuple(prefix))
+            if best is None or len(ids) < len(best):
+                best = ids
+        return best
+
+    # ----- reads -----
+
+    def _find_docs(self, query: Optional[dict]) -> List[dict]:
+        self._expire_ttl()
+        ids = self._candidate_ids(query) if query else None
+        if ids is None:
+            return [doc for doc in self._docs.values() if matches(doc, query)]
+        docs = [self._docs[_id] for _id in ids if _id in self._docs]
+        if len(docs) > 1:
+            # Keep natural (insertion) order like a collection scan would
+            docs.sort(key=lambda d: self._seq[d['_id']])
+        return [doc for doc in docs if matches(doc, query)]
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> InMemoryCursor:
+        return InMemoryCursor(self._find_docs(filter), projection)
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        docs = self._find_docs(filter)
+        return _project(docs[0], projection) if docs else None
+
+    async def count_documents(self, filter: Optional[dict] = None) -> int:
+        return len(self._find_docs(filter))
+
+    # ----- writes -----
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        doc = _bson_copy(document)
+        if doc['_id'] in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error index: _id_ dup key: {doc['_id']}")
+        self._store(doc)
+        return InsertOneResult(doc['_id'])
+
+    async def insert_many(self, documents: List[dict]):
+        return [(await self.insert_one(document)).inserted_id for document in documents]
+
+    def _store(self, doc: dict):
+        self._check_unique(doc)
+        self._docs[doc['_id']] = doc
+        self._seq[doc['_id']] = self._next_seq
+        self._next_seq += 1
+        self._index(doc)
+
+    def _drop(self, doc: dict):
+        self._unindex(doc)
+        del self._docs[doc['_id']]
+        del self._seq[doc['_id']]
+
+    def _modify(self, doc: dict, update: dict):
+        updated = copy.deepcopy(doc)
+        apply_update(updated, update)
+        self._check_unique(updated)
+        self._unindex(doc)
+        self._docs[doc['_id']] = updated
+        self._index(updated)
+        return updated
+
+    def _upsert(self, query: dict, update: dict) -> dict:
+        doc = {k: _bson_copy(v) for k, v in query.items()
+               if not k.startswith('$') and not (isinstance(v, dict) and any(o.startswith('$') for o in v))}
+        apply_update(doc, update, inserting=True)
+        doc.setdefault('_id', ObjectId())
+        self._store(doc)
+        return doc
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        docs = self._find_docs(filter)
+        if docs:
+            self._modify(docs[0], update)
+            return UpdateResult(1, 1)
+        if upsert:
+            return UpdateResult(0, 0, self._upsert(filter, update)['_id'])
+        return UpdateResult(0, 0)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        docs = self._find_docs(filter)
+        for doc in docs:
+            self._modify(doc, update)
+        if not docs and upsert:
+            return UpdateResult(0, 0, self._upsert(filter, update)['_id'])
+        return UpdateResult(len(docs), len(docs))
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection: Optional[dict] = None,
+                                  upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[dict]:
+        docs = self._find_docs(filter)
+        if docs:
+            before = docs[0]
+            after = self._modify(before, update)
+        elif upsert:
+            before, after = None, self._upsert(filter, update)
+        else:
+            return None
+        result = after if return_document == ReturnDocument.AFTER else before
+        return _project(result, projection) if result is not None else None
+
+    async def delete_one(self, filter: dict) -> DeleteResult:
+        docs = self._find_docs(filter)
+        if not docs:
+            return DeleteResult(0)
+        self._drop(docs[0])
+        return DeleteResult(1)
+
+    async def delete_many(self, filter: dict) -> DeleteResult:
+        docs = self._find_docs(filter)
+        for doc in docs:
+            self._drop(doc)
+        return DeleteResult(len(docs))
+
+
+class InMemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, InMemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = InMemoryCollection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> InMemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+
+class InMemoryClient:
+    """Stand-in for AsyncIOMotorClient used with a `memory://` MONGO_URL"""
+
+    def __init__(self):
+        self._databases: Dict[str, InMemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> InMemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = InMemoryDatabase(name)
+        return self._databases[name]
+
+    async def drop_database(self, name: str):
+        self._databases.pop(name if isinstance(name, str) else name.name, None)
+
+    def close(self):
+        pass
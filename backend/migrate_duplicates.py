@@ -0,0 +1,158 @@
+"""One-off merge of duplicate user accounts and carbon impact documents.
+
+Registration and the lazy impact insert used to check and then insert, so
+databases written before the unique indexes on `users.email` and
+`carbon_impacts.user_id` may hold duplicates. The app then starts without
+those indexes. Run this once, with the app stopped, to merge the duplicates
+and build the indexes:
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=ecocommute python migrate_duplicates.py --dry-run
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=ecocommute python migrate_duplicates.py
+
+The merge reads, combines and deletes documents in separate steps, so it
+must not run concurrently with itself or with writers.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from repositories import Storage, create_client
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+# Counters that trips add to, summed when impact documents are merged
+ADDITIVE_IMPACT_FIELDS = ("total_carbon_saved", "money_saved", "sustainable_miles",
+                          "total_trips", "eco_credits", "current_streak")
+
+# Bookings that may still hold seats on a ride
+SEAT_HOLDING_STATUSES = ["pending", "held", "confirmed"]
+
+
+async def move_passenger_entries(storage: Storage, duplicate: str, keeper: str):
+    """Hand a duplicate account's place on rides to the kept account.
+
+    A rider can only hold one place per ride. Where both accounts are
+    passengers, the duplicate's bookings are cancelled and their seats go
+    back to the ride.
+    """
+    rides = storage.ride_offers.collection
+    for ride in await rides.find({"passengers": duplicate}).to_list(None):
+        ride_id = str(ride['_id'])
+        if keeper not in ride['passengers']:
+            passengers = [keeper if user_id == duplicate else user_id for user_id in ride['passengers']]
+            await rides.update_one({"_id": ride['_id']}, {"$set": {"passengers": passengers}})
+            continue
+
+        bookings = await storage.bookings.collection.find({
+            "ride_id": ride_id, "user_id": duplicate, "status": {"$in": SEAT_HOLDING_STATUSES}
+        }).to_list(None)
+        for booking in bookings:
+            booking_id = str(booking['_id'])
+            cancelled = await storage.bookings.transition(
+                booking_id, SEAT_HOLDING_STATUSES,
+                {"status": "cancelled", "expires_at": None, "updated_at": datetime.utcnow()}
+            )
+            if cancelled:
+                await storage.ride_offers.release_seats(ride_id, duplicate, booking['seats'], booking_id)
+
+        # An entry no booking accounts for has no known seat count to return
+        result = await rides.update_one({"_id": ride['_id'], "passengers": duplicate},
+                                        {"$pull": {"passengers": duplicate}})
+        if result.modified_count:
+            logger.warning(f"Ride {ride_id}: dropped passenger {duplicate} without a booking")
+        await storage.ride_offers.mark_available(ride_id)
+
+
+async def merge_users(storage: Storage, email: str, ids: List[ObjectId]):
+    """Keep the oldest account, the one login has always returned"""
+    keeper = str(ids[0])
+    duplicates = [str(_id) for _id in ids[1:]]
+    for duplicate in duplicates:
+        await move_passenger_entries(storage, duplicate, keeper)
+        for collection, field in ((storage.trip_requests.collection, "user_id"),
+                                  (storage.ride_offers.collection, "driver_id"),
+                                  (storage.bookings.collection, "user_id")):
+            await collection.update_many({field: duplicate}, {"$set": {field: keeper}})
+
+    # Impacts are merged rather than re-pointed, the user_id index may exist
+    impacts = storage.carbon_impacts.collection
+    kept_ids = [doc['_id'] for doc in await impacts.find({"user_id": keeper}, {"_id": 1}).to_list(None)]
+    duplicate_ids = [doc['_id'] for doc in
+                     await impacts.find({"user_id": {"$in": duplicates}}, {"_id": 1}).to_list(None)]
+    if duplicate_ids or len(kept_ids) > 1:
+        await merge_impacts(storage, keeper, kept_ids + duplicate_ids)
+
+    users = storage.users.collection
+    if await users.find_one({"_id": {"$in": ids[1:]}, "is_driver": True}):
+        await users.update_one({"_id": ids[0]}, {"$set": {"is_driver": True}})
+    await users.delete_many({"_id": {"$in": ids[1:]}})
+
+
+async def merge_impacts(storage: Storage, user_id: str, ids: List[ObjectId]):
+    """Fold impact documents into the first of `ids` and give it to `user_id`"""
+    impacts = storage.carbon_impacts.collection
+    docs = await impacts.find({"_id": {"$in": ids}}).to_list(None)
+    merged = {field: sum(doc.get(field, 0) for doc in docs) for field in ADDITIVE_IMPACT_FIELDS}
+    trips_by_mode: Dict[str, int] = {}
+    for doc in docs:
+        for mode, count in (doc.get('trips_by_mode') or {}).items():
+            trips_by_mode[mode] = trips_by_mode.get(mode, 0) + count
+    merged['trips_by_mode'] = trips_by_mode
+    merged['longest_streak'] = max(doc.get('longest_streak', 0) for doc in docs)
+    merged['badges'] = list(dict.fromkeys(badge for doc in docs for badge in doc.get('badges', [])))
+    trip_dates = [doc['last_trip_date'] for doc in docs if doc.get('last_trip_date')]
+    if trip_dates:
+        merged['last_trip_date'] = max(trip_dates)
+    # Newer than any copy a running worker may have cached
+    merged['version'] = sum(doc.get('version', 0) for doc in docs) + 1
+    merged['updated_at'] = datetime.utcnow()
+    merged['user_id'] = user_id
+
+    await impacts.update_one({"_id": ids[0]}, {"$set": merged})
+    await impacts.delete_many({"_id": {"$in": ids[1:]}})
+
+
+async def migrate(storage: Storage, dry_run: bool = False) -> Dict[str, int]:
+    """Merge duplicates and build the indexes; returns merged groups per collection"""
+    user_groups = await storage.users.find_duplicates("email")
+    if not dry_run:
+        for email, ids in user_groups.items():
+            await merge_users(storage, email, ids)
+
+    impact_groups = await storage.carbon_impacts.find_duplicates("user_id")
+    if not dry_run:
+        for user_id, ids in impact_groups.items():
+            await merge_impacts(storage, user_id, ids)
+        await storage.ensure_indexes()
+
+    return {"users": len(user_groups), "carbon_impacts": len(impact_groups)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Merge duplicate users and carbon impacts")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be merged")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    client = create_client(os.environ['MONGO_URL'])
+    try:
+        merged = await migrate(Storage(client[os.environ['DB_NAME']]), args.dry_run)
+    finally:
+        client.close()
+    verb = "Would merge" if args.dry_run else "Merged"
+    print(f"{verb} {merged['users']} duplicated emails and "
+          f"{merged['carbon_impacts']} duplicated impact documents")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
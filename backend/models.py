@@ -90,7 +90,7 @@ class TripRequest(BaseModel):
     seats_needed: int = 1
     is_recurring: bool = False
     recurring_days: List[str] = []  # ["monday", "wednesday"]
-    status: str = "searching"  # searching, matched, active, completed, cancelled
+    status: str = "searching"  # searching, matched, active, completed, cancelled, expired
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     class Config:
@@ -106,14 +106,35 @@ class RideOffer(BaseModel):
     available_seats: int
     route_waypoints: List[TripLocation] = []
     passengers: List[str] = []  # list of user_ids
+    booking_ids: List[str] = []  # bookings holding seats, so only they can release them
     price_per_seat: float = 0.0
-    status: str = "available"  # available, full, active, completed
+    status: str = "available"  # available, full, active, completed, expired
+    geometry: Optional[dict] = None  # precomputed by the matcher when the offer is created
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     class Config:
         populate_by_name = True
         json_encoders = {ObjectId: str}
 
+class Booking(BaseModel):
+    id: Optional[str] = Field(alias="_id", default=None)
+    ride_id: str
+    user_id: str
+    seats: int = 1
+    idempotency_key: str
+    status: str = "pending"  # pending, held, confirmed, cancelled, expired, rejected
+    rejection_reason: Optional[str] = None
+    expires_at: Optional[datetime] = None  # deadline for confirming a hold
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    class Config:
+        populate_by_name = True
+        json_encoders = {ObjectId: str}
+
+class BookingRequest(BaseModel):
+    seats: int = 1
+
 class CarbonImpact(BaseModel):
     id: Optional[str] = Field(alias="_id", default=None)
     user_id: str
@@ -127,6 +148,7 @@ class CarbonImpact(BaseModel):
     last_trip_date: Optional[datetime] = None
     eco_credits: int = 0
     badges: List[str] = []
+    version: int = 0  # bumped on every write, used to validate cached copies
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
     class Config:
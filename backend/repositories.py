@@ -0,0 +1,324 @@
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+import logging
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from memory_db import InMemoryClient
+
+logger = logging.getLogger(__name__)
+
+
+def create_client(mongo_url: str):
+    """Motor client for a Mongo URL, or the in-memory backend for `memory://`"""
+    if mongo_url.startswith('memory://'):
+        # Single process only: every worker gets its own copy of the data
+        return InMemoryClient()
+    return AsyncIOMotorClient(mongo_url)
+
+
+def to_object_id(value) -> Optional[ObjectId]:
+    """Parse an id coming from the API, or None if it is malformed"""
+    if isinstance(value, ObjectId):
+        return value
+    if not ObjectId.is_valid(value):
+        return None
+    return ObjectId(value)
+
+
+def serialize(doc: Optional[dict]) -> Optional[dict]:
+    """Stringify the document id so it can leave the storage layer"""
+    if doc is not None and '_id' in doc:
+        doc['_id'] = str(doc['_id'])
+    return doc
+
+
+class Repository:
+    """Base for repositories over a Motor-compatible collection.
+
+    The collection can be a Motor collection or an `InMemoryCollection`;
+    both understand the same query and update documents, so each repository
+    is written once and behaves the same on either backend. Documents are
+    returned with string ids and accepted ids may be strings.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        pass
+
+    async def _insert(self, document: dict) -> str:
+        result = await self.collection.insert_one(document)
+        return str(result.inserted_id)
+
+    async def _ensure_unique_index(self, field: str, name: str) -> bool:
+        """Build a unique index on `field`, or log why it could not be built.
+
+        Databases written before the index existed can hold duplicates. The
+        app then starts without the index; `migrate_duplicates.py` merges
+        the duplicates so the next start can build it.
+        """
+        try:
+            await self.collection.create_index([(field, ASCENDING)], unique=True, name=name)
+            return True
+        except DuplicateKeyError:
+            logger.error(f"Duplicate {self.collection.name}.{field} values prevent building "
+                         f"unique index {name}; run migrate_duplicates.py")
+            return False
+
+    async def find_duplicates(self, field: str) -> Dict[object, List[ObjectId]]:
+        """Ids sharing a value of `field`, oldest first"""
+        groups: Dict[object, List[ObjectId]] = {}
+        async for doc in self.collection.find({}, {field: 1}):
+            groups.setdefault(doc.get(field), []).append(doc['_id'])
+        return {value: sorted(ids) for value, ids in groups.items() if len(ids) > 1}
+
+    async def _expire_batch(self, query: dict, now: datetime, retention: timedelta, limit: int) -> int:
+        """Mark up to `limit` documents matching `query` as expired.
+
+        Expired documents get a `purge_at` date that the partial TTL index
+        (see `_ensure_purge_index`) uses to delete them after `retention`.
+        """
+        stale = await self.collection.find(query, {"_id": 1}).limit(limit).to_list(limit)
+        if not stale:
+            return 0
+        # Repeat the filter so a document that changed since the read is left alone
+        result = await self.collection.update_many(
+            dict(query, _id={"$in": [doc['_id'] for doc in stale]}),
+            {"$set": {"status": "expired", "expired_at": now, "purge_at": now + retention}}
+        )
+        return result.modified_count
+
+    async def _ensure_purge_index(self):
+        await self.collection.create_index(
+            [("purge_at", ASCENDING)],
+            name="purge_at_ttl",
+            expireAfterSeconds=0,
+            partialFilterExpression={"status": "expired"}
+        )
+
+
+class UserRepository(Repository):
+    async def ensure_indexes(self):
+        # Older registrations checked then inserted, so emails may repeat
+        await self._ensure_unique_index("email", "email_unique")
+
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        return serialize(await self.collection.find_one({"email": email}))
+
+    async def create(self, user: dict) -> str:
+        return await self._insert(user)
+
+    async def update_fields(self, user_id: str, fields: dict) -> bool:
+        result = await self.collection.update_one({"_id": to_object_id(user_id)}, {"$set": fields})
+        return result.matched_count > 0
+
+
+class TripRequestRepository(Repository):
+    async def ensure_indexes(self):
+        await self.collection.create_index([("user_id", ASCENDING)], name="user_id")
+        await self.collection.create_index(
+            [("status", ASCENDING), ("departure_time", ASCENDING)], name="status_departure_time"
+        )
+        await self._ensure_purge_index()
+
+    async def create(self, trip: dict) -> str:
+        return await self._insert(trip)
+
+    async def expire_departed(self, cutoff: datetime, now: datetime,
+                              retention: timedelta, limit: int) -> int:
+        """Expire a batch of requests still searching after departing before `cutoff`"""
+        return await self._expire_batch(
+            {"status": "searching", "departure_time": {"$lt": cutoff}}, now, retention, limit
+        )
+
+
+class RideOfferRepository(Repository):
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("status", ASCENDING), ("departure_time", ASCENDING)], name="status_departure_time"
+        )
+        await self.collection.create_index([("driver_id", ASCENDING)], name="driver_id")
+        await self._ensure_purge_index()
+
+    async def create(self, offer: dict) -> str:
+        return await self._insert(offer)
+
+    async def get(self, ride_id: str) -> Optional[dict]:
+        return serialize(await self.collection.find_one({"_id": to_object_id(ride_id)}))
+
+    async def list_available(self, limit: int = 100, now: Optional[datetime] = None) -> List[dict]:
+        """Available offers that have not departed yet, soonest first"""
+        # The departure filter keeps past offers out even before the sweeper
+        # has marked them expired.
+        rides = await self.collection.find({
+            "status": "available",
+            "departure_time": {"$gte": now or datetime.utcnow()}
+        }).sort("departure_time", ASCENDING).to_list(limit)
+        return [serialize(ride) for ride in rides]
+
+    async def expire_departed(self, cutoff: datetime, now: datetime,
+                              retention: timedelta, limit: int) -> int:
+        """Expire a batch of offers still available after departing before `cutoff`"""
+        return await self._expire_batch(
+            {"status": "available", "departure_time": {"$lt": cutoff}}, now, retention, limit
+        )
+
+    async def reserve_seats(self, ride_id: str, user_id: str, seats: int,
+                            booking_id: str) -> Optional[dict]:
+        """Take seats for a rider's booking in one guarded update, or return None"""
+        return serialize(await self.collection.find_one_and_update(
+            {
+                "_id": to_object_id(ride_id),
+                "status": "available",
+                "departure_time": {"$gt": datetime.utcnow()},
+                "available_seats": {"$gte": seats},
+                "passengers": {"$ne": user_id}
+            },
+            {
+                "$inc": {"available_seats": -seats},
+                "$push": {"passengers": user_id, "booking_ids": booking_id}
+            },
+            return_document=ReturnDocument.AFTER
+        ))
+
+    async def release_seats(self, ride_id: str, user_id: str, seats: int,
+                            booking_id: str) -> Optional[dict]:
+        """Give back the seats a booking took; None if it holds none on the ride"""
+        return serialize(await self.collection.find_one_and_update(
+            {"_id": to_object_id(ride_id), "booking_ids": booking_id},
+            {
+                "$inc": {"available_seats": seats},
+                "$pull": {"passengers": user_id, "booking_ids": booking_id}
+            },
+            return_document=ReturnDocument.AFTER
+        ))
+
+    async def mark_full(self, ride_id: str) -> bool:
+        """Flip to full, but only while the ride is still sold out"""
+        result = await self.collection.update_one(
+            {"_id": to_object_id(ride_id), "status": "available", "available_seats": {"$lte": 0}},
+            {"$set": {"status": "full"}}
+        )
+        return result.modified_count > 0
+
+    async def mark_available(self, ride_id: str) -> bool:
+        """Reopen a full ride, but only once it has a free seat again"""
+        result = await self.collection.update_one(
+            {"_id": to_object_id(ride_id), "status": "full", "available_seats": {"$gt": 0}},
+            {"$set": {"status": "available"}}
+        )
+        return result.modified_count > 0
+
+
+class CarbonImpactRepository(Repository):
+    async def ensure_indexes(self):
+        # The impact document used to be created lazily by a racy find-then-insert
+        await self._ensure_unique_index("user_id", "user_id_unique")
+
+    async def get_by_user(self, user_id: str) -> Optional[dict]:
+        return serialize(await self.collection.find_one({"user_id": user_id}))
+
+    async def create(self, impact: dict) -> str:
+        return await self._insert(impact)
+
+    async def get_version(self, user_id: str) -> Optional[int]:
+        """Current version of a user's impact, without reading the document"""
+        impact = await self.collection.find_one({"user_id": user_id}, {"version": 1})
+        return impact.get('version', 0) if impact else None
+
+    async def get_or_create(self, user_id: str, defaults: dict) -> dict:
+        """Fetch a user's impact, inserting `defaults` if there is none yet"""
+        return serialize(await self.collection.find_one_and_update(
+            {"user_id": user_id},
+            {"$setOnInsert": defaults},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        ))
+
+    async def increment(self, user_id: str, deltas: dict, fields: Optional[dict] = None) -> Optional[int]:
+        """Apply `$inc` deltas (and optional `$set` fields) atomically.
+
+        Returns the document's new version, or None if the user has no impact
+        document yet.
+        """
+        update = {"$inc": dict(deltas, version=1)}
+        if fields:
+            update["$set"] = fields
+        impact = await self.collection.find_one_and_update(
+            {"user_id": user_id},
+            update,
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return impact['version'] if impact else None
+
+
+class BookingRepository(Repository):
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("idempotency_key", ASCENDING)],
+            unique=True,
+            name="user_idempotency_key"
+        )
+        await self.collection.create_index(
+            [("status", ASCENDING), ("expires_at", ASCENDING)],
+            name="status_expires_at"
+        )
+
+    async def create(self, booking: dict) -> str:
+        """Insert a booking; raises DuplicateKeyError if its key was used"""
+        return await self._insert(booking)
+
+    async def get(self, booking_id: str, user_id: Optional[str] = None) -> Optional[dict]:
+        query = {"_id": to_object_id(booking_id)}
+        if user_id is not None:
+            query["user_id"] = user_id
+        return serialize(await self.collection.find_one(query))
+
+    async def get_by_idempotency_key(self, user_id: str, key: str) -> Optional[dict]:
+        return serialize(await self.collection.find_one({"user_id": user_id, "idempotency_key": key}))
+
+    async def transition(self, booking_id: str, from_statuses: List[str], fields: dict,
+                         conditions: Optional[dict] = None,
+                         return_after: bool = True) -> Optional[dict]:
+        """Move a booking out of one of `from_statuses` if `conditions` hold"""
+        query = {"_id": to_object_id(booking_id), "status": {"$in": from_statuses}}
+        query.update(conditions or {})
+        return serialize(await self.collection.find_one_and_update(
+            query,
+            {"$set": fields},
+            return_document=ReturnDocument.AFTER if return_after else ReturnDocument.BEFORE
+        ))
+
+    async def delete(self, booking_id: str) -> bool:
+        result = await self.collection.delete_one({"_id": to_object_id(booking_id)})
+        return result.deleted_count > 0
+
+    async def list_expired_holds(self, now: datetime, limit: int) -> List[dict]:
+        # Pending bookings only outlive their request if it crashed mid-way
+        holds = await self.collection.find(
+            {"status": {"$in": ["pending", "held"]}, "expires_at": {"$lte": now}}
+        ).limit(limit).to_list(limit)
+        return [serialize(hold) for hold in holds]
+
+
+class Storage:
+    """All repositories for one database"""
+
+    def __init__(self, db):
+        self.db = db
+        self.users = UserRepository(db.users)
+        self.trip_requests = TripRequestRepository(db.trip_requests)
+        self.ride_offers = RideOfferRepository(db.ride_offers)
+        self.carbon_impacts = CarbonImpactRepository(db.carbon_impacts)
+        self.bookings = BookingRepository(db.bookings)
+
+    async def ensure_indexes(self):
+        for repository in (self.users, self.trip_requests, self.ride_offers,
+                           self.carbon_impacts, self.bookings):
+            await repository.ensure_indexes()
@@ -1,5 +1,5 @@
-from typing import List, Dict, Tuple
-from datetime import datetime, timedelta
+from typing import List, Dict, Tuple, Optional
+from datetime import datetime, timedelta, timezone
 from geopy.distance import geodesic
 import math
 
@@ -10,6 +10,9 @@ class RideMatchingEngine:
         self.MAX_DETOUR_PERCENT = 0.15  # 15% max detour
         self.MAX_TIME_WINDOW_MINUTES = 30
         self.MAX_DETOUR_MINUTES = 10
+        self.AVERAGE_SPEED_KMH = 30  # urban driving speed for detour and ETA estimates
+        self.CORRIDOR_MARGIN = 1.05  # slack so the planar corridor never rejects a valid point
+        self.CORRIDOR_MARGIN_KM = 0.05
     
     def calculate_distance(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
         """Calculate distance in km between two coordinates using Haversine formula"""
@@ -24,10 +27,12 @@ class RideMatchingEngine:
     
     def is_point_on_route(self, point: Tuple[float, float], 
                           origin: Tuple[float, float], 
-                          destination: Tuple[float, float]) -> Tuple[bool, float]:
+                          destination: Tuple[float, float],
+                          direct_distance: Optional[float] = None) -> Tuple[bool, float]:
         """Check if a point is reasonably on the route between origin and destination"""
-        # Calculate direct route distance
-        direct_distance = self.calculate_distance(origin, destination)
+        # Calculate direct route distance, unless precomputed for the offer
+        if direct_distance is None:
+            direct_distance = self.calculate_distance(origin, destination)
         
         # Calculate detour distance
         detour_distance = (self.calculate_distance(origin, point) + 
@@ -39,6 +44,13 @@ class RideMatchingEngine:
         is_on_route = detour_percent <= self.MAX_DETOUR_PERCENT
         return is_on_route, detour_percent
     
+    @staticmethod
+    def _naive_utc(value: datetime) -> datetime:
+        """Drop the offset of an aware datetime after converting it to UTC"""
+        if value.tzinfo is None:
+            return value
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    
     def time_window_matches(self, time1: datetime, time2: datetime, 
                            flexibility_minutes: int = 15) -> Tuple[bool, float]:
         """Check if two times are within acceptable window"""
@@ -47,27 +59,152 @@ class RideMatchingEngine:
         score = 1.0 - (time_diff_minutes / self.MAX_TIME_WINDOW_MINUTES)
         return matches, max(0, score)
     
-    def calculate_match_score(self, trip_request: dict, ride_offer: dict) -> float:
-        """Calculate compatibility score between trip request and ride offer"""
-        score = 0.0
+    def _to_plane(self, point: Tuple[float, float], anchor: Tuple[float, float]) -> Tuple[float, float]:
+        """Project a coordinate to local x/y kilometres around an anchor"""
+        x = (point[1] - anchor[1]) * 111.320 * math.cos(math.radians(anchor[0]))
+        y = (point[0] - anchor[0]) * 110.574
+        return x, y
+    
+    def _from_plane(self, xy: Tuple[float, float], anchor: Tuple[float, float]) -> Tuple[float, float]:
+        lat = anchor[0] + xy[1] / 110.574
+        lon = anchor[1] + xy[0] / (111.320 * math.cos(math.radians(anchor[0])))
+        return lat, lon
+    
+    def build_offer_geometry(self, ride_offer: dict) -> Dict:
+        """Precompute the per-offer geometry the matcher needs, once per offer.
+        
+        - direct_distance_km: origin -> destination distance
+        - route_points / cumulative_km: the driven route (origin, waypoints,
+          destination) and the distance driven when reaching each point
+        - corridor: polygon around origin -> destination that contains every
+          point passing the MAX_DETOUR_PERCENT check, and its bounding box
+        """
+        origin = (ride_offer['origin']['latitude'], ride_offer['origin']['longitude'])
+        destination = (ride_offer['destination']['latitude'], ride_offer['destination']['longitude'])
+        waypoints = [(w['latitude'], w['longitude']) for w in ride_offer.get('route_waypoints', [])]
+        route_points = [origin] + waypoints + [destination]
+        
+        cumulative_km = [0.0]
+        for i in range(len(route_points) - 1):
+            cumulative_km.append(cumulative_km[-1] + self.calculate_distance(route_points[i], route_points[i + 1]))
+        
+        direct_distance = self.calculate_distance(origin, destination)
+        
+        # Points within the detour budget lie in an ellipse with the offer's
+        # origin and destination as foci; the corridor is the rectangle around it.
+        half_width = (direct_distance / 2) * math.sqrt((1 + self.MAX_DETOUR_PERCENT) ** 2 - 1)
+        overhang = direct_distance * self.MAX_DETOUR_PERCENT / 2
+        half_width = half_width * self.CORRIDOR_MARGIN + self.CORRIDOR_MARGIN_KM
+        overhang = overhang * self.CORRIDOR_MARGIN + self.CORRIDOR_MARGIN_KM
+        
+        end_x, end_y = self._to_plane(destination, origin)
+        length = math.hypot(end_x, end_y)
+        corridor = []
+        if length > 0:
+            ux, uy = end_x / length, end_y / length
+            nx, ny = -uy, ux
+            for (bx, by), along in (((0.0, 0.0), -overhang), ((end_x, end_y), overhang)):
+                for side in ((1, -1) if along < 0 else (-1, 1)):
+                    corner = (bx + ux * along + nx * half_width * side,
+                              by + uy * along + ny * half_width * side)
+                    corridor.append(list(self._from_plane(corner, origin)))
+        
+        lats = [c[0] for c in corridor] or [origin[0]]
+        lons = [c[1] for c in corridor] or [origin[1]]
+        
+        return {
+            'direct_distance_km': direct_distance,
+            'route_distance_km': cumulative_km[-1],
+            'route_points': [list(p) for p in route_points],
+            'cumulative_km': cumulative_km,
+            'bbox': [min(lats), min(lons), max(lats), max(lons)],
+            'corridor': corridor
+        }
+    
+    def is_point_in_corridor(self, point: Tuple[float, float], geometry: Dict) -> bool:
+        """Cheap planar pre-check against the offer's bounding box and corridor"""
+        min_lat, min_lon, max_lat, max_lon = geometry['bbox']
+        if not (min_lat <= point[0] <= max_lat and min_lon <= point[1] <= max_lon):
+            return False
+        
+        # Ray casting on the corridor polygon
+        corridor = geometry['corridor']
+        inside = False
+        j = len(corridor) - 1
+        for i in range(len(corridor)):
+            lat_i, lon_i = corridor[i]
+            lat_j, lon_j = corridor[j]
+            if (lat_i > point[0]) != (lat_j > point[0]):
+                crossing = lon_i + (point[0] - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+                if point[1] < crossing:
+                    inside = not inside
+            j = i
+        return inside
+    
+    def estimate_insertion(self, geometry: Dict, pickup_distances: List[float],
+                           dropoff_distances: List[float], pickup_to_dropoff: float) -> Dict:
+        """Cheapest insertion of a pickup and a later dropoff into the offer's route.
+        
+        `pickup_distances[i]` / `dropoff_distances[i]` are the distances from
+        route point i to the rider's pickup / dropoff. Returns the extra
+        distance driven and how far along the route the pickup happens.
+        """
+        cumulative = geometry['cumulative_km']
+        segments = len(cumulative) - 1
+        
+        def insertion_cost(distances, k):
+            return distances[k] + distances[k + 1] - (cumulative[k + 1] - cumulative[k])
+        
+        best = None
+        best_pickup = None  # (cost, segment) of the cheapest pickup so far
+        for k in range(segments):
+            # Pickup and dropoff both in segment k
+            segment_length = cumulative[k + 1] - cumulative[k]
+            same = pickup_distances[k] + pickup_to_dropoff + dropoff_distances[k + 1] - segment_length
+            if best is None or same < best[0]:
+                best = (same, k)
+            # Pickup in an earlier segment, dropoff in segment k
+            if best_pickup is not None:
+                split = best_pickup[0] + insertion_cost(dropoff_distances, k)
+                if split < best[0]:
+                    best = (split, best_pickup[1])
+            pickup_cost = insertion_cost(pickup_distances, k)
+            if best_pickup is None or pickup_cost < best_pickup[0]:
+                best_pickup = (pickup_cost, k)
+        
+        detour_km, pickup_segment = best
+        detour_km = max(0.0, detour_km)
+        pickup_offset_km = cumulative[pickup_segment] + pickup_distances[pickup_segment]
+        return {
+            'detour_km': round(detour_km, 2),
+            'detour_minutes': round(detour_km / self.AVERAGE_SPEED_KMH * 60, 1),
+            'pickup_offset_km': round(pickup_offset_km, 2),
+            'pickup_offset_minutes': pickup_offset_km / self.AVERAGE_SPEED_KMH * 60
+        }
+    
+    def evaluate_match(self, trip_request: dict, ride_offer: dict) -> Optional[Dict]:
+        """Score a trip request against a ride offer and estimate the detour.
+        
+        Returns None when the pair is not compatible.
+        """
+        geometry = ride_offer.get('geometry') or self.build_offer_geometry(ride_offer)
+        direct_distance = geometry['direct_distance_km']
+        if direct_distance <= 0:
+            return None
         
         # Extract coordinates
         req_origin = (trip_request['origin']['latitude'], trip_request['origin']['longitude'])
         req_dest = (trip_request['destination']['latitude'], trip_request['destination']['longitude'])
-        offer_origin = (ride_offer['origin']['latitude'], ride_offer['origin']['longitude'])
-        offer_dest = (ride_offer['destination']['latitude'], ride_offer['destination']['longitude'])
         
-        # 1. Route Similarity Score (40 points)
-        origin_on_route, origin_detour = self.is_point_on_route(req_origin, offer_origin, offer_dest)
-        dest_on_route, dest_detour = self.is_point_on_route(req_dest, offer_origin, offer_dest)
+        # Reject pairs outside the offer's corridor before any geodesic math
+        if not (self.is_point_in_corridor(req_origin, geometry) and
+                self.is_point_in_corridor(req_dest, geometry)):
+            return None
         
-        if origin_on_route and dest_on_route:
-            route_score = 40 * (1 - (origin_detour + dest_detour) / 2)
-            score += route_score
-        else:
-            return 0  # Not compatible
+        # Capacity and time window are cheap, check them before routing
+        if ride_offer['available_seats'] < trip_request.get('seats_needed', 1):
+            return None  # Not enough seats
         
-        # 2. Time Window Score (30 points)
         req_time = trip_request['departure_time']
         offer_time = ride_offer['departure_time']
         
@@ -75,32 +212,63 @@ class RideMatchingEngine:
             req_time = datetime.fromisoformat(req_time.replace('Z', '+00:00'))
         if isinstance(offer_time, str):
             offer_time = datetime.fromisoformat(offer_time.replace('Z', '+00:00'))
+        # Clients send UTC with an offset, stored documents come back naive
+        req_time, offer_time = self._naive_utc(req_time), self._naive_utc(offer_time)
         
         time_matches, time_score = self.time_window_matches(
             req_time, offer_time, 
             trip_request.get('flexibility_minutes', 15)
         )
+        if not time_matches:
+            return None  # Not compatible
+        
+        route_points = [tuple(p) for p in geometry['route_points']]
+        offer_origin, offer_dest = route_points[0], route_points[-1]
+        
+        # 1. Route Similarity Score (40 points)
+        origin_on_route, origin_detour = self.is_point_on_route(
+            req_origin, offer_origin, offer_dest, direct_distance
+        )
+        dest_on_route, dest_detour = self.is_point_on_route(
+            req_dest, offer_origin, offer_dest, direct_distance
+        )
+        if not (origin_on_route and dest_on_route):
+            return None  # Not compatible
+        score = 40 * (1 - (origin_detour + dest_detour) / 2)
         
-        if time_matches:
-            score += 30 * time_score
-        else:
-            return 0  # Not compatible
+        # Distances from every route point to the pickup and dropoff
+        pickup_distances = [self.calculate_distance(p, req_origin) for p in route_points]
+        dropoff_distances = [self.calculate_distance(p, req_dest) for p in route_points]
+        
+        # 2. Time Window Score (30 points)
+        score += 30 * time_score
         
         # 3. Capacity Check (20 points)
-        if ride_offer['available_seats'] >= trip_request.get('seats_needed', 1):
-            score += 20
-        else:
-            return 0  # Not enough seats
+        score += 20
         
         # 4. Convenience Score (10 points) - based on pickup/dropoff proximity
-        pickup_distance = self.calculate_distance(req_origin, offer_origin)
-        dropoff_distance = self.calculate_distance(req_dest, offer_dest)
+        pickup_distance = pickup_distances[0]
+        dropoff_distance = dropoff_distances[-1]
         
         # Closer pickup/dropoff = higher score
         convenience_score = 10 * (1 - min(1, (pickup_distance + dropoff_distance) / 10))
         score += convenience_score
         
-        return score
+        insertion = self.estimate_insertion(
+            geometry, pickup_distances, dropoff_distances,
+            self.calculate_distance(req_origin, req_dest)
+        )
+        return {
+            'score': score,
+            'detour_km': insertion['detour_km'],
+            'detour_minutes': insertion['detour_minutes'],
+            'pickup_eta': offer_time + timedelta(minutes=insertion['pickup_offset_minutes'])
+        }
+    
+    def calculate_match_score(self, trip_request: dict, ride_offer: dict) -> float:
+        """Calculate compatibility score between trip request and ride offer"""
+        match = self.evaluate_match(trip_request, ride_offer)
+        return match['score'] if match else 0
     
     def find_matches(self, trip_request: dict, available_rides: List[dict], 
                     top_n: int = 3) -> List[Dict]:
@@ -111,14 +279,15 @@ class RideMatchingEngine:
             if ride['status'] != 'available':
                 continue
             
-            score = self.calculate_match_score(trip_request, ride)
+            match = self.evaluate_match(trip_request, ride)
             
-            if score > 0:
+            if match and match['score'] > 0:
                 matches.append({
                     'ride': ride,
-                    'score': score,
-                    'estimated_pickup_time': ride['departure_time'],
-                    'estimated_detour_minutes': 5  # Simplified for now
+                    'score': match['score'],
+                    'estimated_pickup_time': match['pickup_eta'],
+                    'estimated_detour_km': match['detour_km'],
+                    'estimated_detour_minutes': match['detour_minutes']
                 })
         
         # Sort by score descending
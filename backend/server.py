@@ -1,32 +1,40 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Header
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import JSONResponse
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import uuid
+import asyncio
 from datetime import datetime
+from pymongo.errors import DuplicateKeyError
 
 # Import our models and utilities
 from models import (
     UserProfile, UserRegister, UserLogin, TokenResponse,
-    TripRequest, RideOffer, CarbonImpact, Challenge
+    TripRequest, RideOffer, CarbonImpact, Challenge, BookingRequest
 )
 from auth import hash_password, verify_password, create_access_token, decode_access_token
 from ride_matching import RideMatchingEngine
 from carbon_calculator import CarbonCalculator
+from booking import SeatBookingService, BookingError
+from repositories import Storage, create_client
+from impact_cache import ImpactCache
+from coalescing import SingleFlight, AdmissionController, Overloaded
+from lifecycle import LifecycleSweeper
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection (MONGO_URL=memory:// selects the in-memory backend)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = create_client(mongo_url)
 db = client[os.environ['DB_NAME']]
+storage = Storage(db)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -38,6 +46,42 @@ api_router = APIRouter(prefix="/api")
 # Initialize engines
 ride_matcher = RideMatchingEngine()
 carbon_calc = CarbonCalculator()
+booking_service = SeatBookingService(storage)
+impact_cache = ImpactCache(
+    max_entries=int(os.environ.get('IMPACT_CACHE_SIZE', 10000)),
+    # Reads without X-Impact-Version; 0 checks the stored version every time
+    ttl_seconds=float(os.environ.get('IMPACT_CACHE_TTL_SECONDS', 2)),
+    max_age_seconds=float(os.environ.get('IMPACT_CACHE_MAX_AGE_SECONDS', 3600))
+)
+lifecycle_sweeper = LifecycleSweeper(storage, booking_service)
+
+# Identical available-ride reads share one query, reused for this long
+AVAILABLE_RIDES_CACHE_SECONDS = 1.0
+available_rides_flight = SingleFlight(ttl_seconds=AVAILABLE_RIDES_CACHE_SECONDS)
+
+# Concurrency limits for the endpoints that get hammered when a class lets out
+rides_available_admission = AdmissionController(
+    "rides/available", max_concurrency=64, max_queue_seconds=0.5
+)
+trips_request_admission = AdmissionController(
+    "trips/request", max_concurrency=32, max_queue_seconds=1.0
+)
+
+# Internal to the matcher and seat accounting, never sent to clients
+PRIVATE_RIDE_FIELDS = ('geometry', 'booking_ids')
+
+def public_ride(ride: dict) -> dict:
+    """A ride offer as sent to clients"""
+    return {key: value for key, value in ride.items() if key not in PRIVATE_RIDE_FIELDS}
+
+async def load_available_ride_offers() -> Tuple[List[dict], List[dict]]:
+    rides = await storage.ride_offers.list_available(100)
+    return rides, [public_ride(ride) for ride in rides]
+
+async def get_available_ride_offers() -> Tuple[List[dict], List[dict]]:
+    """Available offers for matching, and the same offers for responses"""
+    # Shared between concurrent requests, callers must not modify the result
+    return await available_rides_flight.do("available", load_available_ride_offers)
 
 # Helper function to get current user from token
 async def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
@@ -50,18 +94,17 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
     
-    user = await db.users.find_one({"email": payload.get("sub")})
+    user = await storage.users.get_by_email(payload.get("sub"))
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     
-    user['_id'] = str(user['_id'])
     return user
 
 # ============= AUTH ROUTES =============
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserRegister):
     # Check if user already exists
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await storage.users.get_by_email(user_data.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -76,12 +119,14 @@ async def register(user_data: UserRegister):
     )
     
     # Insert user
-    result = await db.users.insert_one(user_profile.dict(by_alias=True, exclude={'id'}))
-    user_id = str(result.inserted_id)
+    try:
+        user_id = await storage.users.create(user_profile.dict(by_alias=True, exclude={'id'}))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create carbon impact record
     carbon_impact = CarbonImpact(user_id=user_id)
-    await db.carbon_impacts.insert_one(carbon_impact.dict(by_alias=True, exclude={'id'}))
+    await storage.carbon_impacts.create(carbon_impact.dict(by_alias=True, exclude={'id'}))
     
     # Create access token
     access_token = create_access_token(data={"sub": user_data.email})
@@ -99,7 +144,7 @@ async def register(user_data: UserRegister):
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     # Find user
-    user = await db.users.find_one({"email": credentials.email})
+    user = await storage.users.get_by_email(credentials.email)
     if not user or not verify_password(credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
@@ -109,7 +154,7 @@ async def login(credentials: UserLogin):
     return TokenResponse(
         access_token=access_token,
         user={
-            "id": str(user['_id']),
+            "id": user['_id'],
             "email": user['email'],
             "full_name": user['full_name'],
             "university": user.get('university', ''),
@@ -135,27 +180,27 @@ async def update_profile(profile_data: dict, authorization: Optional[str] = Head
     update_data = {k: v for k, v in profile_data.items() if k in allowed_fields}
     
     if update_data:
-        await db.users.update_one(
-            {"_id": user['_id']},
-            {"$set": update_data}
-        )
+        await storage.users.update_fields(user['_id'], update_data)
     
     return {"message": "Profile updated successfully"}
 
 # ============= TRIP & RIDE MATCHING ROUTES =============
 @api_router.post("/trips/request")
 async def create_trip_request(trip_data: TripRequest, authorization: Optional[str] = Header(None)):
-    user = await get_current_user(authorization)
-    
-    trip_data.user_id = user['_id']
-    result = await db.trip_requests.insert_one(trip_data.dict(by_alias=True, exclude={'id'}))
-    
-    # Find matching rides
-    available_rides = await db.ride_offers.find({"status": "available"}).to_list(100)
-    matches = ride_matcher.find_matches(trip_data.dict(), available_rides)
+    async with trips_request_admission:
+        user = await get_current_user(authorization)
+        
+        trip_data.user_id = user['_id']
+        trip_id = await storage.trip_requests.create(trip_data.dict(by_alias=True, exclude={'id'}))
+        
+        # Find matching rides
+        available_rides, _ = await get_available_ride_offers()
+        matches = ride_matcher.find_matches(trip_data.dict(), available_rides)
+        for match in matches:
+            match['ride'] = public_ride(match['ride'])
     
     return {
-        "trip_id": str(result.inserted_id),
+        "trip_id": trip_id,
         "matches": matches,
         "message": f"Found {len(matches)} matching rides"
     }
@@ -168,37 +213,93 @@ async def create_ride_offer(ride_data: RideOffer, authorization: Optional[str] =
         raise HTTPException(status_code=400, detail="User must be registered as driver")
     
     ride_data.driver_id = user['_id']
-    result = await db.ride_offers.insert_one(ride_data.dict(by_alias=True, exclude={'id'}))
+    offer = ride_data.dict(by_alias=True, exclude={'id'})
+    # Computed once here so matching never redoes it per trip request
+    offer['geometry'] = ride_matcher.build_offer_geometry(offer)
+    ride_id = await storage.ride_offers.create(offer)
+    available_rides_flight.invalidate()
     
     return {
-        "ride_id": str(result.inserted_id),
+        "ride_id": ride_id,
         "message": "Ride offer created successfully"
     }
 
 @api_router.get("/rides/available")
 async def get_available_rides(authorization: Optional[str] = Header(None)):
-    await get_current_user(authorization)
+    async with rides_available_admission:
+        await get_current_user(authorization)
+        
+        _, rides = await get_available_ride_offers()
+        return rides
+
+# ============= BOOKING ROUTES =============
+@api_router.post("/rides/{ride_id}/book")
+async def book_ride(ride_id: str, booking_data: BookingRequest,
+                    authorization: Optional[str] = Header(None),
+                    idempotency_key: Optional[str] = Header(None)):
+    user = await get_current_user(authorization)
+    
+    try:
+        booking, created = await booking_service.hold_seats(
+            ride_id, user['_id'], booking_data.seats, idempotency_key
+        )
+    except BookingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     
-    rides = await db.ride_offers.find({"status": "available"}).to_list(100)
+    if booking['status'] == "rejected":
+        # Bookings rejected before reasons were recorded only failed the seat guard
+        detail = booking.get('rejection_reason') or "Not enough seats available on this ride"
+        raise HTTPException(status_code=409, detail=detail)
     
-    # Convert ObjectId to string
-    for ride in rides:
-        ride['_id'] = str(ride['_id'])
+    return {
+        "booking": booking,
+        "replayed": not created,
+        "message": "Seats held, confirm before the hold expires"
+    }
+
+@api_router.post("/bookings/{booking_id}/confirm")
+async def confirm_booking(booking_id: str, authorization: Optional[str] = Header(None)):
+    user = await get_current_user(authorization)
+    
+    try:
+        booking = await booking_service.confirm_booking(booking_id, user['_id'])
+    except BookingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    return {"booking": booking, "message": "Booking confirmed"}
+
+@api_router.post("/bookings/{booking_id}/cancel")
+async def cancel_booking(booking_id: str, authorization: Optional[str] = Header(None)):
+    user = await get_current_user(authorization)
+    
+    try:
+        booking = await booking_service.cancel_booking(booking_id, user['_id'])
+    except BookingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     
-    return rides
+    return {"booking": booking, "message": "Booking cancelled"}
 
 # ============= CARBON IMPACT ROUTES =============
 @api_router.get("/impact")
-async def get_user_impact(authorization: Optional[str] = Header(None)):
+async def get_user_impact(authorization: Optional[str] = Header(None),
+                          x_impact_version: Optional[int] = Header(None)):
     user = await get_current_user(authorization)
     
-    impact = await db.carbon_impacts.find_one({"user_id": user['_id']})
+    # The client sends the last version it knows; only the user writes their
+    # impact, so a cached copy at or above it is current. Without the header,
+    # a copy past the short TTL is checked with a version-only read.
+    impact = impact_cache.get(user['_id'], x_impact_version)
+    if impact is None and impact_cache.stale_version(user['_id'], x_impact_version) is not None:
+        impact = impact_cache.revalidate(user['_id'], await storage.carbon_impacts.get_version(user['_id']))
+    if impact:
+        return impact
+    
+    impact = await storage.carbon_impacts.get_by_user(user['_id'])
     if not impact:
         # Create default impact record
-        impact = CarbonImpact(user_id=user['_id'])
-        await db.carbon_impacts.insert_one(impact.dict(by_alias=True, exclude={'id'}))
-    else:
-        impact['_id'] = str(impact['_id'])
+        defaults = CarbonImpact(user_id=user['_id']).dict(by_alias=True, exclude={'id'})
+        impact = await storage.carbon_impacts.get_or_create(user['_id'], defaults)
+    impact_cache.put(impact)
     
     return impact
 
@@ -215,30 +316,29 @@ async def record_trip_impact(trip_data: dict, authorization: Optional[str] = Hea
     money_saved = carbon_calc.calculate_money_saved(mode, distance_km, passengers)
     credits = carbon_calc.calculate_eco_credits(mode, distance_km, passengers)
     
-    # Update user's carbon impact
-    await db.carbon_impacts.update_one(
-        {"user_id": user['_id']},
-        {
-            "$inc": {
-                "total_carbon_saved": carbon_data['carbon_saved_kg'],
-                "money_saved": money_saved,
-                "sustainable_miles": distance_km * 0.621371,  # km to miles
-                "total_trips": 1,
-                f"trips_by_mode.{mode}": 1,
-                "eco_credits": credits,
-                "current_streak": 1
-            },
-            "$set": {
-                "last_trip_date": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-        }
-    )
+    # Update user's carbon impact, then replay the same deltas on the cache
+    deltas = {
+        "total_carbon_saved": carbon_data['carbon_saved_kg'],
+        "money_saved": money_saved,
+        "sustainable_miles": distance_km * 0.621371,  # km to miles
+        "total_trips": 1,
+        f"trips_by_mode.{mode}": 1,
+        "eco_credits": credits,
+        "current_streak": 1
+    }
+    fields = {
+        "last_trip_date": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
+    version = await storage.carbon_impacts.increment(user['_id'], deltas, fields)
+    if version is not None:
+        impact_cache.apply_deltas(user['_id'], version, deltas, fields)
     
     return {
         "carbon_saved": carbon_data,
         "money_saved": money_saved,
         "credits_earned": credits,
+        "impact_version": version,
         "message": "Trip impact recorded successfully"
     }
 
@@ -254,6 +354,14 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after_seconds)}
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -269,6 +377,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_storage():
+    await storage.ensure_indexes()
+    app.state.lifecycle_sweeper = asyncio.create_task(lifecycle_sweeper.run_forever())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.lifecycle_sweeper.cancel()
     client.close()
@@ -14,17 +14,22 @@ interface Impact {
   current_streak: number;
   eco_credits: number;
   badges: string[];
+  version?: number;
 }
 
 interface ImpactState {
   impact: Impact | null;
+  // Latest impact version this client wrote or read; the server never answers with an older copy
+  knownVersion: number | null;
   isLoading: boolean;
   fetchImpact: () => Promise<void>;
   recordTrip: (tripData: any) => Promise<void>;
+  reset: () => void;
 }
 
-export const useImpactStore = create<ImpactState>((set) => ({
+export const useImpactStore = create<ImpactState>((set, get) => ({
   impact: null,
+  knownVersion: null,
   isLoading: false,
 
   fetchImpact: async () => {
@@ -32,10 +37,18 @@ export const useImpactStore = create<ImpactState>((set) => ({
     try {
       const token = useAuthStore.getState().token;
       const response = await axios.get(`${API_URL}/api/impact`, {
-        headers: { Authorization: `Bearer ${token}` },
+        headers: {
+          Authorization: `Bearer ${token}`,
+          // Without a known version the server checks its cached copy first
+          ...(get().knownVersion !== null && { 'X-Impact-Version': String(get().knownVersion) }),
+        },
       });
 
-      set({ impact: response.data, isLoading: false });
+      set({
+        impact: response.data,
+        knownVersion: Math.max(get().knownVersion ?? 0, response.data.version || 0),
+        isLoading: false,
+      });
     } catch (error) {
       set({ isLoading: false });
       console.error('Failed to fetch impact:', error);
@@ -45,9 +58,12 @@ export const useImpactStore = create<ImpactState>((set) => ({
   recordTrip: async (tripData: any) => {
     try {
       const token = useAuthStore.getState().token;
-      await axios.post(`${API_URL}/api/impact/record-trip`, tripData, {
+      const response = await axios.post(`${API_URL}/api/impact/record-trip`, tripData, {
         headers: { Authorization: `Bearer ${token}` },
       });
+      if (response.data.impact_version) {
+        set({ knownVersion: Math.max(get().knownVersion ?? 0, response.data.impact_version) });
+      }
 
       // Refresh impact data
       await useImpactStore.getState().fetchImpact();
@@ -55,4 +71,13 @@ export const useImpactStore = create<ImpactState>((set) => ({
       console.error('Failed to record trip:', error);
     }
   },
-}));
\ No newline at end of file
+
+  reset: () => set({ impact: null, knownVersion: null }),
+}));
+
+// The known version belongs to the signed-in user, start over when that changes
+useAuthStore.subscribe((state, previous) => {
+  if (state.token !== previous.token) {
+    useImpactStore.getState().reset();
+  }
+});
\ No newline at end of file
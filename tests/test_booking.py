@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from booking import BookingError, SeatBookingService
+from memory_db import InMemoryClient
+from models import Booking, RideOffer, TripLocation
+from repositories import Storage
+
+
+def make_service():
+    storage = Storage(InMemoryClient()["booking_tests"])
+    asyncio.run(storage.ensure_indexes())
+    return storage, SeatBookingService(storage)
+
+
+def create_ride(storage, seats=2, departs_in=timedelta(hours=1)):
+    ride = RideOffer(
+        driver_id="driver",
+        origin=TripLocation(latitude=40.7128, longitude=-74.0060, address="Campus"),
+        destination=TripLocation(latitude=40.7580, longitude=-73.9855, address="Downtown"),
+        departure_time=datetime.utcnow() + departs_in,
+        available_seats=seats
+    )
+    return asyncio.run(storage.ride_offers.create(ride.dict(by_alias=True, exclude={'id'})))
+
+
+def get_ride(storage, ride_id):
+    return asyncio.run(storage.ride_offers.get(ride_id))
+
+
+def test_hold_and_confirm():
+    storage, service = make_service()
+    ride_id = create_ride(storage, seats=2)
+
+    booking, created = asyncio.run(service.hold_seats(ride_id, "rider", 1, "key"))
+    assert created and booking['status'] == "held"
+    ride = get_ride(storage, ride_id)
+    assert ride['available_seats'] == 1
+    assert ride['passengers'] == ["rider"]
+    assert ride['booking_ids'] == [booking['_id']]
+
+    confirmed = asyncio.run(service.confirm_booking(booking['_id'], "rider"))
+    assert confirmed['status'] == "confirmed"
+    # Confirming again is a no-op
+    assert asyncio.run(service.confirm_booking(booking['_id'], "rider"))['status'] == "confirmed"
+
+
+def test_last_seat_marks_ride_full_and_cancel_reopens_it():
+    storage, service = make_service()
+    ride_id = create_ride(storage, seats=1)
+
+    booking, _ = asyncio.run(service.hold_seats(ride_id, "rider", 1, "key"))
+    assert get_ride(storage, ride_id)['status'] == "full"
+
+    cancelled = asyncio.run(service.cancel_booking(booking['_id'], "rider"))
+    assert cancelled['status'] == "cancelled"
+    ride = get_ride(storage, ride_id)
+    assert ride['available_seats'] == 1
+    assert ride['status'] == "available"
+    assert ride['passengers'] == [] and ride['booking_ids'] == []
+
+    # Cancelling twice does not hand the seat back twice
+    asyncio.run(service.cancel_booking(booking['_id'], "rider"))
+    assert get_ride(storage, ride_id)['available_seats'] == 1
+
+
+def test_expired_hold_releases_seats_and_cannot_be_confirmed():
+    storage, service = make_service()
+    ride_id = create_ride(storage, seats=2)
+    booking, _ = asyncio.run(service.hold_seats(ride_id, "rider", 2, "key"))
+
+    later = datetime.utcnow() + timedelta(minutes=service.HOLD_MINUTES + 1)
+    assert asyncio.run(service.release_expired_holds(later)) == 1
+    assert asyncio.run(storage.bookings.get(booking['_id']))['status'] == "expired"
+    assert get_ride(storage, ride_id)['available_seats'] == 2
+
+    with pytest.raises(BookingError) as error:
+        asyncio.run(service.confirm_booking(booking['_id'], "rider"))
+    assert error.value.status_code == 409
+
+
+def test_retry_with_same_key_replays_the_booking():
+    storage, service = make_service()
+    ride_id = create_ride(storage, seats=2)
+
+    first, created = asyncio.run(service.hold_seats(ride_id, "rider", 1, "key"))
+    replay, replay_created = asyncio.run(service.hold_seats(ride_id, "rider", 1, "key"))
+    assert created and not replay_created
+    assert replay['_id'] == first['_id'] and replay['status'] == "held"
+    assert get_ride(storage, ride_id)['available_seats'] == 1
+
+    with pytest.raises(BookingError) as error:
+        asyncio.run(service.hold_seats(ride_id, "rider", 2, "key"))
+    assert error.value.status_code == 422
+
+
+def test_retry_while_first_request_is_pending_is_not_a_hold():
+    storage, service = make_service()
+    ride_id = create_ride(storage, seats=1)
+    # The first request claimed the key but has not reserved seats yet
+    pending = Booking(ride_id=ride_id, user_id="rider", idempotency_key="key",
+                      expires_at=datetime.utcnow() + timedelta(minutes=10))
+    asyncio.run(storage.bookings.create(pending.dict(by_alias=True, exclude={'id'})))
+
+    with pytest.raises(BookingError) as error:
+        asyncio.run(service.hold_seats(ride_id, "rider", 1, "key"))
+    assert error.value.status_code == 409
+    assert get_ride(storage, ride_id)['available_seats'] == 1
+
+
+def test_rejections_explain_why():
+    storage, service = make_service()
+
+    with pytest.raises(BookingError) as error:
+        asyncio.run(service.hold_seats("507f1f77bcf86cd799439011", "rider", 1, "missing"))
+    assert error.value.status_code == 404
+    assert asyncio.run(storage.bookings.get_by_idempotency_key("rider", "missing")) is None
+
+    departed = create_ride(storage, departs_in=timedelta(minutes=-1))
+    booking, _ = asyncio.run(service.hold_seats(departed, "rider", 1, "departed"))
+    assert booking['status'] == "rejected"
+    assert booking['rejection_reason'] == "Ride has departed or is no longer available"
+
+    small = create_ride(storage, seats=1)
+    booking, _ = asyncio.run(service.hold_seats(small, "rider", 2, "too-many"))
+    assert booking['rejection_reason'] == "Not enough seats available on this ride"
+    replay, created = asyncio.run(service.hold_seats(small, "rider", 2, "too-many"))
+    assert not created and replay['status'] == "rejected"
+
+
+def test_expiring_crashed_pending_booking_keeps_other_booking_seats():
+    storage, service = make_service()
+    ride_id = create_ride(storage, seats=2)
+    # A request that crashed after claiming its key, before reserving seats
+    crashed = Booking(ride_id=ride_id, user_id="rider", idempotency_key="crashed",
+                      expires_at=datetime.utcnow() - timedelta(minutes=1))
+    crashed_id = asyncio.run(storage.bookings.create(crashed.dict(by_alias=True, exclude={'id'})))
+
+    booking, _ = asyncio.run(service.hold_seats(ride_id, "rider", 1, "retry"))
+    asyncio.run(service.confirm_booking(booking['_id'], "rider"))
+
+    asyncio.run(service.release_expired_holds())
+    assert asyncio.run(storage.bookings.get(crashed_id))['status'] == "expired"
+    ride = get_ride(storage, ride_id)
+    assert ride['available_seats'] == 1
+    assert ride['passengers'] == ["rider"]
+    assert ride['booking_ids'] == [booking['_id']]
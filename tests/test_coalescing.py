@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+import coalescing
+from coalescing import AdmissionController, Overloaded
+
+
+def test_slot_handed_over_as_queue_timeout_fires(monkeypatch):
+    """A waiter that gets the slot as its timeout fires is admitted, not leaked"""
+    async def scenario():
+        controller = AdmissionController("test", max_concurrency=1, max_queue_seconds=0.01)
+        await controller.acquire()
+
+        async def wait_for_with_late_handover(future, timeout):
+            # What wait_for does on 3.12+ when release() resolves the waiter
+            # in the same loop iteration that the timeout fires
+            controller.release()
+            assert future.done()
+            raise asyncio.TimeoutError()
+
+        monkeypatch.setattr(coalescing.asyncio, "wait_for", wait_for_with_late_handover)
+        await controller.acquire()
+        assert controller.shed == 0
+        assert controller.admitted == 2
+
+        controller.release()
+        assert controller._active == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_sheds_without_leaking_slot():
+    async def scenario():
+        controller = AdmissionController("test", max_concurrency=1, max_queue_seconds=0.01)
+        await controller.acquire()
+        with pytest.raises(Overloaded):
+            await controller.acquire()
+        controller.release()
+
+        assert controller.shed == 1
+        assert controller._active == 0
+        assert not controller._waiters
+
+    asyncio.run(scenario())
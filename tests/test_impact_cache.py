@@ -0,0 +1,112 @@
+import impact_cache
+from impact_cache import ImpactCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(impact_cache.time, "monotonic", clock)
+    return ImpactCache(**kwargs), clock
+
+
+def impact(version, **fields):
+    return dict({"user_id": "rider", "total_trips": 0, "trips_by_mode": {"bike": 0},
+                 "version": version}, **fields)
+
+
+def test_deltas_replay_the_write(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.put(impact(3))
+
+    cache.apply_deltas("rider", 4, {"total_trips": 1, "trips_by_mode.bike": 1, "trips_by_mode.walk": 2},
+                       {"last_trip_date": "today"})
+
+    entry = cache.get("rider", client_version=4)
+    assert entry["total_trips"] == 1
+    assert entry["trips_by_mode"] == {"bike": 1, "walk": 2}
+    assert entry["last_trip_date"] == "today"
+    assert entry["version"] == 4
+
+
+def test_skipped_version_evicts_the_entry(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.put(impact(3))
+
+    # The write to version 4 went through another worker
+    cache.apply_deltas("rider", 5, {"total_trips": 1})
+
+    assert len(cache) == 0
+    assert cache.get("rider") is None
+
+
+def test_put_never_replaces_a_newer_copy(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.put(impact(5, total_trips=5))
+    cache.put(impact(4, total_trips=4))
+
+    assert cache.get("rider")["total_trips"] == 5
+
+
+def test_entries_are_copies(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.put(impact(1))
+    cache.get("rider")["trips_by_mode"]["bike"] = 99
+
+    assert cache.get("rider")["trips_by_mode"]["bike"] == 0
+
+
+def test_client_version_proves_freshness_for_the_max_age(monkeypatch):
+    cache, clock = make_cache(monkeypatch, ttl_seconds=2, max_age_seconds=3600)
+    cache.put(impact(3))
+    clock.now += 600
+
+    assert cache.get("rider", client_version=3)["version"] == 3
+    # The client knows a newer version than the cached one
+    assert cache.get("rider", client_version=4) is None
+    assert cache.stale_version("rider", client_version=4) is None
+
+    clock.now += 3600
+    assert cache.get("rider", client_version=3) is None
+    assert cache.stale_version("rider", client_version=3) == 3
+
+
+def test_without_client_version_entries_are_revalidated_after_the_ttl(monkeypatch):
+    cache, clock = make_cache(monkeypatch, ttl_seconds=2)
+    cache.put(impact(3))
+    assert cache.get("rider") is not None
+
+    clock.now += 3
+    assert cache.get("rider") is None
+    assert cache.stale_version("rider") == 3
+
+    # The database still has version 3, serve it for another TTL
+    assert cache.revalidate("rider", 3)["version"] == 3
+    assert cache.get("rider") is not None
+    assert cache.revalidations == 1
+
+
+def test_revalidation_evicts_an_outdated_entry(monkeypatch):
+    cache, clock = make_cache(monkeypatch, ttl_seconds=2)
+    cache.put(impact(3))
+    clock.now += 3
+
+    assert cache.revalidate("rider", 4) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    cache, _ = make_cache(monkeypatch, max_entries=2)
+    for user_id in ("a", "b"):
+        cache.put(dict(impact(1), user_id=user_id))
+    cache.get("a")
+    cache.put(dict(impact(1), user_id="c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
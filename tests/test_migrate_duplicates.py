@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+import pytest
+
+from booking import SeatBookingService
+from memory_db import InMemoryClient
+from migrate_duplicates import migrate
+from repositories import Storage
+
+
+async def seed_duplicates(db):
+    """Two accounts for one email that both booked the same ride"""
+    keeper = str((await db.users.insert_one({"email": "a@campus.edu", "is_driver": False})).inserted_id)
+    duplicate = str((await db.users.insert_one({"email": "a@campus.edu", "is_driver": True})).inserted_id)
+    await db.carbon_impacts.insert_one({"user_id": keeper, "total_trips": 2, "trips_by_mode": {"bike": 2},
+                                        "badges": ["first"], "version": 2, "longest_streak": 3})
+    await db.carbon_impacts.insert_one({"user_id": duplicate, "total_trips": 1, "trips_by_mode": {"walk": 1},
+                                        "badges": ["first", "walker"], "version": 1,
+                                        "last_trip_date": datetime(2026, 1, 1)})
+    await db.trip_requests.insert_one({"user_id": duplicate})
+
+    storage = Storage(db)
+    await storage.ensure_indexes()
+    ride_id = await storage.ride_offers.create({
+        "driver_id": "driver", "status": "available", "available_seats": 3,
+        "passengers": [], "booking_ids": [], "departure_time": datetime.utcnow() + timedelta(hours=1)
+    })
+    service = SeatBookingService(storage)
+    await service.hold_seats(ride_id, keeper, 1, "keeper")
+    duplicate_booking, _ = await service.hold_seats(ride_id, duplicate, 2, "duplicate")
+    return storage, keeper, duplicate, ride_id, duplicate_booking['_id']
+
+
+def test_startup_tolerates_duplicates_and_migration_merges_them():
+    async def scenario():
+        db = InMemoryClient()["migration_tests"]
+        storage, keeper, duplicate, ride_id, duplicate_booking = await seed_duplicates(db)
+
+        assert await migrate(storage, dry_run=True) == {"users": 1, "carbon_impacts": 0}
+        assert await db.users.count_documents({}) == 2
+
+        await migrate(storage)
+
+        users = await db.users.find({}).to_list(None)
+        assert [str(user['_id']) for user in users] == [keeper]
+        assert users[0]['is_driver'] is True
+        assert (await db.trip_requests.find_one({}))['user_id'] == keeper
+
+        impacts = await db.carbon_impacts.find({}).to_list(None)
+        assert len(impacts) == 1
+        impact = impacts[0]
+        assert impact['user_id'] == keeper
+        assert impact['total_trips'] == 3
+        assert impact['trips_by_mode'] == {"bike": 2, "walk": 1}
+        assert impact['badges'] == ["first", "walker"]
+        assert impact['version'] == 4
+
+        # The duplicate's seats go back to the ride instead of being lost
+        ride = await storage.ride_offers.get(ride_id)
+        assert ride['passengers'] == [keeper]
+        assert ride['available_seats'] == 2
+        assert duplicate_booking not in ride['booking_ids']
+        assert (await storage.bookings.get(duplicate_booking))['status'] == "cancelled"
+
+        with pytest.raises(DuplicateKeyError):
+            await db.users.insert_one({"email": "a@campus.edu"})
+
+    asyncio.run(scenario())